@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+import re
+
+# Summary: An in-memory model of the access groups in our Terraform. An access group is a run of lines
+# like
+#       "isMemberOfGroupNameContains(\"team-a\") OR ",
+#       "isMemberOfGroupNameContains(\"role-b\")"
+# that together make up one OR expression. parse_access_groups loads each one into an AccessGroup,
+# which is the list of group names plus how the block was laid out. Edits are made to the names, and
+# render writes the block back out with the OR joins where they belong, so nothing has to patch up
+# the bottom line of a block by hand. Blocks that don't look like this are left exactly as they are.
+
+# One line of an access group: its indent, the group name, the OR joining it to the next line (every
+# line but the last has one), and the comma after the closing quote.
+ACCESS_GROUP_LINE = re.compile(r'(?P<indent>[ \t]*)"isMemberOfGroupNameContains\(\\"(?P<name>[^"\\]+)\\"\)(?P<join> OR )?"(?P<comma>,?)[ \t]*')
+
+# The order normalize puts names in: role- groups first, then org- and team- groups, then anything else.
+NAME_ORDER = ('role-', 'org-', 'team-')
+
+
+def name_order(name):
+    for position, prefix in enumerate(NAME_ORDER):
+        if name.startswith(prefix):
+            return (position, name)
+    return (len(NAME_ORDER), name)
+
+
+# The escaped form a group name takes in our Terraform, e.g. (\"role-x\"). Handy for finding files
+# that mention a group without parsing them.
+def quoted(name):
+    return f'(\\"{name}\\")'
+
+
+class AccessGroup:
+    # start and end are the line numbers of the block, as a slice of the file's lines.
+    def __init__(self, start, end, indent, comma, newline, names):
+        self.start = start
+        self.end = end
+        self.indent = indent
+        self.comma = comma
+        self.newline = newline
+        self.names = names
+        self.changed = False
+
+    # Adds a name just above another one (or at the bottom), unless the group already has it.
+    def add(self, name, before=None):
+        if name in self.names:
+            return
+        position = self.names.index(before) if before in self.names else len(self.names)
+        self.names.insert(position, name)
+        self.changed = True
+
+    def remove(self, name):
+        if name in self.names:
+            self.names = [existing for existing in self.names if existing != name]
+            self.changed = True
+
+    # Drops duplicate names and sorts the rest into NAME_ORDER.
+    def normalize(self):
+        names = sorted(dict.fromkeys(self.names), key=name_order)
+        if names != self.names:
+            self.names = names
+            self.changed = True
+
+    # Returns the block's lines. A group with every name removed renders as nothing.
+    def render(self):
+        lines = [f'{self.indent}"isMemberOfGroupNameContains(\\"{name}\\") OR ",{self.newline}' for name in self.names]
+        if lines:
+            lines[-1] = f'{self.indent}"isMemberOfGroupNameContains(\\"{self.names[-1]}\\")"{self.comma}{self.newline}'
+        return lines
+
+
+# Returns an AccessGroup for every access group in a file's lines, in file order. A run of access
+# group lines ends at the first line without an OR. Runs holding a line that doesn't fit the layout
+# (a comment, or an OR carried on past the run) are skipped.
+def parse_access_groups(lines):
+    groups = []
+    start = None
+    names = []
+    skipping = False
+    for number, line in enumerate(lines):
+        match = ACCESS_GROUP_LINE.fullmatch(line.rstrip('\r\n'))
+        if match is None:
+            # Any other line ends the run. An access group line we can't lay out, or any line breaking
+            # into a run that is still joined by an OR, spoils the rest of it.
+            skipping = 'isMemberOfGroupNameContains(' in line or start is not None
+            start = None
+            names = []
+        elif not skipping:
+            if start is None:
+                start = number
+            names.append(match['name'])
+            if match['join'] is None:
+                newline = line[len(line.rstrip('\r\n')):]
+                groups.append(AccessGroup(start, number + 1, match['indent'], match['comma'], newline, names))
+                start = None
+                names = []
+    return groups
+
+
+# Makes every edit to the access groups in a file's lines in one go. additions maps a group name to
+# the names to add to every access group that has it, each one just above the name that called for
+# it. removals are taken out of every access group, and normalize sorts them all. Only the blocks that
+# change are rendered again. Returns the new lines, or None if nothing changed.
+def edit_access_groups(lines, additions, removals=(), normalize=False):
+    changed = []
+    for group in parse_access_groups(lines):
+        for name in list(group.names):
+            for new_name in additions.get(name, ()):
+                group.add(new_name, before=name)
+        for name in removals:
+            group.remove(name)
+        if normalize:
+            group.normalize()
+        if group.changed:
+            changed.append(group)
+    if not changed:
+        return None
+    output = []
+    position = 0
+    for group in changed:
+        output.extend(lines[position:group.start])
+        output.extend(group.render())
+        position = group.end
+    output.extend(lines[position:])
+    return output
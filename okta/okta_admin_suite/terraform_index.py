@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+import os
+import re
+import sqlite3
+import hashlib
+
+# Summary: A persistent index of every isMemberOfGroupNameContains reference in the non-identity repo.
+# For each group name it records the .tf files, and the line span of each access group block, that
+# mention it. The index is kept up to date incrementally: only .tf files whose modification time or
+# size has changed since the last run are read again, so the rewriters can go straight to the files
+# that mention a role and where_used can answer without grepping the repo.
+
+INDEX_DIRECTORY = os.path.join(os.path.expanduser("~"), ".cache", "okta")
+
+# Every line of an access group has this in it. A run of lines that do is one access group block.
+ACCESS_GROUP_MARKER = 'isMemberOfGroupNameContains('
+
+# Matches the group name in both isMemberOfGroupNameContains("name") and the escaped (\"name\") form
+# our Terraform uses inside strings.
+GROUP_NAME_PATTERN = re.compile(r'isMemberOfGroupNameContains\(\\?"([^"\\]+)\\?"\)')
+
+
+# Returns (group name, first line, last line) for every group referenced in a file's lines, where the
+# line span is the access group block the reference sits in. Line numbers start at 1.
+def find_references(lines):
+    references = []
+    block_start = None
+    block_names = []
+    for number, line in enumerate(lines + [''], start=1):
+        if ACCESS_GROUP_MARKER in line:
+            if block_start is None:
+                block_start = number
+            block_names.extend(GROUP_NAME_PATTERN.findall(line))
+        elif block_start is not None:
+            for name in dict.fromkeys(block_names):
+                references.append((name, block_start, number - 1))
+            block_start = None
+            block_names = []
+    return references
+
+
+class AccessGroupIndex:
+    # Each repo gets its own index file, named after a hash of the repo's path.
+    def __init__(self, repo, path=None):
+        self.repo = os.path.abspath(repo)
+        if path is None:
+            os.makedirs(INDEX_DIRECTORY, exist_ok=True)
+            digest = hashlib.sha1(self.repo.encode()).hexdigest()[:16]
+            path = os.path.join(INDEX_DIRECTORY, f"access_groups_{digest}.sqlite3")
+        self._db = sqlite3.connect(path)
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS refs (group_name TEXT, path TEXT, start_line INTEGER, end_line INTEGER)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS refs_by_group ON refs (group_name)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS refs_by_path ON refs (path)')
+
+    # Brings the index up to date with the repo. Files are only read again if their modification time
+    # or size changed, and files that have gone are dropped. Returns the index so calls can be chained.
+    def refresh(self):
+        known = {path: (mtime_ns, size) for path, mtime_ns, size in self._db.execute('SELECT path, mtime_ns, size FROM files')}
+        seen = set()
+        with self._db:
+            for subdir, _, files in os.walk(self.repo):
+                for file in files:
+                    if not file.endswith('.tf'):
+                        continue
+                    file_path = os.path.join(subdir, file)
+                    path = os.path.relpath(file_path, self.repo)
+                    seen.add(path)
+                    stat = os.stat(file_path)
+                    if known.get(path) == (stat.st_mtime_ns, stat.st_size):
+                        continue
+                    with open(file_path, 'r') as f:
+                        lines = f.read().splitlines()
+                    self._db.execute('DELETE FROM refs WHERE path = ?', (path,))
+                    self._db.executemany('INSERT INTO refs VALUES (?, ?, ?, ?)',
+                                         [(name, path, start, end) for name, start, end in find_references(lines)])
+                    self._db.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?)', (path, stat.st_mtime_ns, stat.st_size))
+            for path in known.keys() - seen:
+                self._db.execute('DELETE FROM refs WHERE path = ?', (path,))
+                self._db.execute('DELETE FROM files WHERE path = ?', (path,))
+        return self
+
+    # Returns (file path, first line, last line) for every access group block that mentions a group.
+    def where_used(self, group_name):
+        rows = self._db.execute('SELECT path, start_line, end_line FROM refs WHERE group_name = ? ORDER BY path, start_line', (group_name,))
+        return [(os.path.join(self.repo, path), start, end) for path, start, end in rows]
+
+    # Returns the sorted paths of every .tf file that mentions any of the groups.
+    def files_referencing(self, group_names):
+        group_names = list(group_names)
+        placeholders = ', '.join('?' * len(group_names))
+        rows = self._db.execute(f'SELECT DISTINCT path FROM refs WHERE group_name IN ({placeholders}) ORDER BY path', group_names)
+        return [os.path.join(self.repo, path) for path, in rows]
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+import os
+import sys
+import mmap
+import shutil
+import difflib
+import tempfile
+from itertools import repeat
+from access_groups import edit_access_groups, quoted
+
+# Summary: The engine behind the admin suite's Terraform changes. Rather than walking the whole
+# non-identity repo once per change, it walks the repo once, loads the access groups of each .tf file
+# into the model in access_groups.py, makes every change to them at once, and only rewrites the files
+# that actually change. Given an AccessGroupIndex it skips the walk too, and only opens the files the
+# index says mention the groups being changed.
+#
+# Each file's new content is built in memory, and then swapped in with a temp file and os.replace, so
+# an error halfway through can never leave a truncated .tf file behind. With dry_run nothing is
+# written and a unified diff of each change is printed instead. Files are handed out to a process
+# pool once there are enough of them to be worth it, and any file whose bytes don't hold one of the
+# texts being searched for is skipped through an mmap before it is ever read in or decoded.
+
+# Below this many files it is quicker to rewrite them in this process than to start a process pool.
+PROCESS_POOL_MIN_FILES = 64
+
+# How many files each process pool worker is handed at a time.
+PROCESS_POOL_CHUNK_SIZE = 16
+
+
+# Raised once every file has been rewritten, if any file still holds a line a rewrite was meant to take
+# out, e.g. a retired role in an access group laid out in a way that can't be edited safely.
+class RewriteIncompleteError(Exception):
+    def __init__(self, left_behind):
+        self.left_behind = left_behind
+        places = ''.join(f'\n  {file_path}:{number}: {line.strip()}' for file_path, number, line in left_behind)
+        super().__init__(f"{len(left_behind)} line(s) still hold what was being removed, in access groups "
+                         f"that couldn't be edited safely. Change them by hand:{places}")
+
+
+# Yields the path of every .tf file under directory, in the same order on every run.
+def find_tf_files(directory):
+    for subdir, dirs, files in os.walk(directory):
+        dirs.sort()
+        for file in sorted(files):
+            if file.endswith('.tf'):
+                yield os.path.join(subdir, file)
+
+
+# Returns the .tf files worth opening to edit the access groups holding any of group_names. With an
+# index that is just the files that mention them; without one (or with no names to go on) it is every
+# .tf file in the repo.
+def candidate_files(directory, group_names, index=None):
+    if index is not None and group_names:
+        return index.refresh().files_referencing(group_names)
+    return find_tf_files(directory)
+
+
+# The byte strings a file has to hold at least one of to be worth reading.
+def needles_for(group_names):
+    return tuple(dict.fromkeys(quoted(name).encode() for name in group_names))
+
+
+# Checks a file for any of the needles straight from an mmap of it, without reading it into memory.
+def file_contains(file_path, needles):
+    with open(file_path, 'rb') as f:
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                return any(buffer.find(needle) != -1 for needle in needles)
+        except ValueError:
+            # Empty files can't be mapped, and hold nothing anyway.
+            return False
+
+
+# Replaces a file's content with text through a temp file in the same directory, so the file is
+# either wholly the old content or wholly the new one.
+def write_atomically(file_path, text):
+    directory, name = os.path.split(file_path)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=f'.{name}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', newline='') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        shutil.copymode(file_path, temp_path)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+# The unified diff of a change to one file, naming the file relative to root so it applies with git apply.
+def file_diff(file_path, lines, new_lines, root=None):
+    name = (os.path.relpath(file_path, root) if root else file_path).replace(os.sep, '/')
+    diff = []
+    for line in difflib.unified_diff(lines, new_lines, fromfile=f'a/{name}', tofile=f'b/{name}'):
+        diff.append(line)
+        if not line.endswith('\n'):
+            # The last line of a file with no newline at the end, which a patch has to say so about.
+            diff.append('\n\\ No newline at end of file\n')
+    return ''.join(diff)
+
+
+# Runs transform(lines, *transform_args) over one file. Files that hold none of the needles are not
+# read at all. Line endings are kept as they are. Returns whether the file changed, the diff of the
+# change on a dry run (the change is written otherwise), and (line number, line) for every line of the
+# result that still holds one of the removed texts.
+def rewrite_file(file_path, needles, transform, transform_args, dry_run, root=None, removed=()):
+    if needles and not file_contains(file_path, needles):
+        return False, '', []
+    with open(file_path, 'r', newline='') as f:
+        lines = f.readlines()
+    new_lines = transform(lines, *transform_args)
+    result = lines if new_lines is None else new_lines
+    left_behind = [(number, line) for number, line in enumerate(result, start=1) if any(text in line for text in removed)]
+    if new_lines is None:
+        return False, '', left_behind
+    if dry_run:
+        return True, file_diff(file_path, lines, new_lines, root), left_behind
+    write_atomically(file_path, ''.join(new_lines))
+    return True, '', left_behind
+
+
+# The walker every rewrite goes through. It runs transform(lines, *transform_args) over every file in
+# file_paths that holds one of the needles, on a process pool when there are enough of them. Any
+# module level function that takes a file's lines and returns its new lines (or None for no change)
+# can be plugged in as the transform. Results come back in file order whichever worker finishes
+# first. Prints each diff on a dry run, and returns the paths of the files that changed (or would have).
+# Any line still holding one of the removed texts afterwards raises RewriteIncompleteError.
+def rewrite_files(file_paths, needles, transform, transform_args, dry_run=False, root=None, removed=()):
+    file_paths = list(file_paths)
+    arguments = (file_paths, repeat(needles), repeat(transform), repeat(transform_args), repeat(dry_run), repeat(root), repeat(removed))
+    if len(file_paths) < PROCESS_POOL_MIN_FILES:
+        return collect_changes(file_paths, map(rewrite_file, *arguments))
+    # Only imported once there is a pool to start, as it pulls in all of multiprocessing.
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor() as pool:
+        return collect_changes(file_paths, pool.map(rewrite_file, *arguments, chunksize=PROCESS_POOL_CHUNK_SIZE))
+
+
+def collect_changes(file_paths, results):
+    changed_files = []
+    left_behind = []
+    for file_path, (changed, diff, lines) in zip(file_paths, results):
+        if changed:
+            sys.stdout.write(diff)
+            changed_files.append(file_path)
+        left_behind.extend((file_path, number, line) for number, line in lines)
+    if left_behind:
+        raise RewriteIncompleteError(left_behind)
+    return changed_files
+
+
+# Here are some functions to handle big changes to our infrastructure.
+# This one makes a whole batch of edits to the access groups in the .tf files under directory, in one
+# pass over the repo: every group in additions gets its new names added to each access group it is in,
+# every name in removals comes out of each access group, and normalize sorts them all. Only files that
+# change are written. Returns the paths of the files that changed. A name in removals that is still in
+# a file afterwards, because its access group wasn't laid out in a way we can edit, raises
+# RewriteIncompleteError once everything else is done.
+def rewrite_access_groups(directory, additions=None, removals=(), normalize=False, index=None, dry_run=False):
+    additions = {name: list(dict.fromkeys(new_names)) for name, new_names in (additions or {}).items()}
+    removals = list(dict.fromkeys(removals))
+    if not additions and not removals and not normalize:
+        return []
+    # Normalizing touches every access group, so there is nothing to narrow the search with.
+    group_names = [] if normalize else list(additions) + removals
+    file_paths = candidate_files(directory, group_names, index)
+    return rewrite_files(file_paths, needles_for(group_names), edit_access_groups, (additions, removals, normalize),
+                         dry_run, directory, tuple(quoted(name) for name in removals))
+
+
+# This one adds new names above the groups they are keyed by in additions, e.g. a new role above each
+# of a user's current roles and org- and team- groups. This is to stage the role access when preparing
+# to switch roles.
+def search_and_insert_many(directory, additions, index=None, dry_run=False):
+    return rewrite_access_groups(directory, additions=additions, index=index, dry_run=dry_run)
+
+
+# This is a clean-up function. It looks for all instances of the old
+# role and removes it.
+def search_and_destroy(directory, group_name, index=None, dry_run=False):
+    return rewrite_access_groups(directory, removals=[group_name], index=index, dry_run=dry_run)
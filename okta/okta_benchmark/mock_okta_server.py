@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from urllib.parse import urlsplit, parse_qs, urlencode
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Summary: A local stand-in for Okta and for Quip's SCIM API, so the scripts and the benchmark can run
+# without a live tenant. It serves a synthetic org of any size from /api/v1 (users, groups, apps, the
+# listings between them and the System Log) and Quip's /Users, /Bulk and /ServiceProviderConfig from
+# /scim/2.
+#
+# Like Okta, every listing is paged with limit/after cursors and a Link: rel="next" header, and every
+# response carries X-Rate-Limit-Limit/Remaining/Reset headers for its bucket, with a 429 once a
+# bucket is spent. Each request can be held for a fixed latency (plus jitter) to look like a real
+# round trip. Point the Okta scripts at it with OKTA_BASE_URL, and the Quip Lambdas with QUIP_SCIM_URL.
+
+DEFAULT_PORT = 8765
+
+# Okta's default page size, and the largest page each listing will hand out.
+DEFAULT_PAGE_SIZE = 200
+MAX_PAGE_SIZE = 1000
+
+# The length of a rate limit window in seconds, as Okta uses.
+RATE_LIMIT_WINDOW = 60
+
+# The most operations Quip's /Bulk takes in one request, when bulk is turned on.
+SCIM_BULK_MAX_OPERATIONS = 100
+
+# When every mock user was last updated, for lastUpdated searches.
+ORG_CREATED = '2024-01-01T00:00:00.000Z'
+
+# Matches one clause of an Okta filter or search expression, e.g. profile.name sw "role-".
+EXPRESSION_CLAUSE = re.compile(r'([\w.]+) (eq|sw|gt) "([^"]*)"')
+
+
+# A synthetic org. Every user is in one role- group, one org- group and one team- group. Every org-
+# and team- group is assigned a few apps, and one user in ten is also assigned an app directly. The
+# layout only depends on the sizes, so the same sizes always give the same org.
+class MockOrg:
+    def __init__(self, users=1000, roles=40, orgs=12, teams=None, apps=600, domain='example'):
+        self.user_count = users
+        self.domain = domain
+        teams = teams or max(20, users // 50)
+
+        self.groups = ([(f'00grole{i}', f'role-{i:03}') for i in range(roles)] +
+                       [(f'00gorg{i}', f'org-{i:03}') for i in range(orgs)] +
+                       [(f'00gteam{i}', f'team-{i:04}') for i in range(teams)])
+        self.group_index = {group_id: position for position, (group_id, _) in enumerate(self.groups)}
+        self.apps = [(f'0oa{i}', f'app_{i}', f'App {i:03}', 'ACTIVE' if i % 20 else 'INACTIVE') for i in range(apps)]
+        self.app_index = {app_id: position for position, (app_id, _, _, _) in enumerate(self.apps)}
+
+        self.user_groups = [(i % roles, roles + i % orgs, roles + orgs + (i // 3) % teams) for i in range(users)]
+        self.group_members = [[] for _ in self.groups]
+        for user, groups in enumerate(self.user_groups):
+            for group in groups:
+                self.group_members[group].append(user)
+        self.group_apps = [[] if group < roles else [(group * 3 + k) % apps for k in range(3)] for group in range(len(self.groups))]
+        self.direct_app = {user: (user * 31) % apps for user in range(0, users, 10)}
+        self.logins = {self.login(user): user for user in range(users)}
+        # System Log events served from /api/v1/logs. The org never changes by itself, so this stays
+        # empty unless a test appends to it.
+        self.events = []
+        self._app_users = {}
+        self._lock = threading.Lock()
+
+    def login(self, user):
+        return f'first{user}.last{user}@{self.domain}.com'
+
+    def user_json(self, user):
+        return {'id': f'00u{user}', 'status': 'ACTIVE', 'lastUpdated': ORG_CREATED,
+                'profile': {'login': self.login(user), 'email': self.login(user), 'firstName': f'First{user}', 'lastName': f'Last{user}'}}
+
+    def group_json(self, group):
+        group_id, name = self.groups[group]
+        return {'id': group_id, 'type': 'OKTA_GROUP', 'profile': {'name': name, 'description': ''}}
+
+    def app_json(self, app):
+        app_id, name, label, status = self.apps[app]
+        return {'id': app_id, 'name': name, 'label': label, 'status': status}
+
+    # Every user assigned an app, as (user, scope). Direct assignments win over group ones. Worked out
+    # the first time the app is listed.
+    def app_users(self, app):
+        with self._lock:
+            if app not in self._app_users:
+                scopes = {}
+                for group, apps in enumerate(self.group_apps):
+                    if app in apps:
+                        for user in self.group_members[group]:
+                            scopes[user] = 'GROUP'
+                for user, direct in self.direct_app.items():
+                    if direct == app:
+                        scopes[user] = 'USER'
+                self._app_users[app] = sorted(scopes.items())
+            return self._app_users[app]
+
+    def app_user_json(self, user, scope):
+        return {'id': f'00u{user}', 'scope': scope, 'status': 'PROVISIONED',
+                'credentials': {'userName': self.login(user)} if user % 7 else None}
+
+
+# Builds a predicate from an Okta filter or search expression made of eq/sw clauses joined by "or".
+# fields maps an attribute like profile.name to a function reading it from an item.
+def expression_matcher(expression, fields):
+    clauses = EXPRESSION_CLAUSE.findall(expression)
+    if not clauses or any(attribute not in fields for attribute, _, _ in clauses):
+        return None
+
+    def matches(item):
+        for attribute, operator, value in clauses:
+            actual = fields[attribute](item)
+            if operator == 'gt':
+                if actual > value:
+                    return True
+            elif (actual.lower() == value.lower()) if operator == 'eq' else actual.lower().startswith(value.lower()):
+                return True
+        return False
+    return matches
+
+
+# A fixed window counter for each rate limit bucket, shared by every request thread.
+class MockRateLimits:
+    def __init__(self, limit):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._windows = {}
+
+    # Spends one request from a bucket. Returns (allowed, limit, remaining, reset).
+    def spend(self, bucket):
+        now = time.time()
+        with self._lock:
+            reset, used = self._windows.get(bucket, (0, 0))
+            if now >= reset:
+                reset, used = int(now) + RATE_LIMIT_WINDOW, 0
+            allowed = used < self.limit
+            if allowed:
+                used += 1
+            self._windows[bucket] = (reset, used)
+        return allowed, self.limit, self.limit - used, reset
+
+
+# Quip's side: users created through /Users or /Bulk, kept in memory for as long as the server runs.
+class MockScim:
+    def __init__(self, bulk=False):
+        self.bulk = bulk
+        self._lock = threading.Lock()
+        self._users = {}
+        self._next_id = 0
+
+    def find(self, filter_text):
+        clause = EXPRESSION_CLAUSE.search(filter_text)
+        email = (clause.group(3) if clause else filter_text).lower()
+        with self._lock:
+            return [user for user in self._users.values() if user['userName'] == email]
+
+    def create(self, body):
+        emails = body.get('emails') or [{}]
+        email = (body.get('userName') or emails[0].get('value') or '').lower()
+        if not email:
+            return 400, {'detail': 'A user needs an e-mail'}
+        with self._lock:
+            if any(user['userName'] == email for user in self._users.values()):
+                return 409, {'detail': f'{email} already exists'}
+            self._next_id += 1
+            user = {'schemas': ['urn:ietf:params:scim:schemas:core:2.0:User'], 'id': f'quip{self._next_id}',
+                    'userName': email, 'name': body.get('name', {}), 'emails': [{'value': email}]}
+            self._users[user['id']] = user
+        return 201, user
+
+    def delete(self, user_id):
+        with self._lock:
+            return 204 if self._users.pop(user_id, None) else 404
+
+
+# Everything the benchmark reads back from /_mock/stats.
+class MockStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.rate_limited = 0
+        self.bytes_sent = 0
+
+    def count(self, status, size):
+        with self._lock:
+            self.requests += 1
+            self.rate_limited += status == 429
+            self.bytes_sent += size
+
+    def as_json(self):
+        with self._lock:
+            return {'requests': self.requests, 'rate_limited': self.rate_limited, 'bytes_sent': self.bytes_sent}
+
+
+class MockOktaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    # The headers and body go out in separate writes. With Nagle's algorithm on, the body then waits
+    # for the client's delayed ACK on every keep-alive request, which caps throughput at ~25 requests
+    # per connection per second.
+    disable_nagle_algorithm = True
+
+    # The server carries the org, rate limits, SCIM store, stats and latency settings.
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_DELETE(self):
+        self.handle_request('DELETE')
+
+    def handle_request(self, method):
+        url = urlsplit(self.path)
+        self.query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        length = int(self.headers.get('Content-Length') or 0)
+        self.body = json.loads(self.rfile.read(length) or b'null') if length else None
+        path = url.path.rstrip('/')
+
+        if path == '/_mock/stats':
+            return self.send_json(200, self.server.stats.as_json(), counted=False)
+
+        if self.server.latency:
+            time.sleep(self.server.latency + random.uniform(0, self.server.jitter))
+
+        rate_limit_headers = {}
+        if self.server.rate_limits is not None:
+            allowed, limit, remaining, reset = self.server.rate_limits.spend('/'.join(path.split('/')[:4]))
+            rate_limit_headers = {'X-Rate-Limit-Limit': limit, 'X-Rate-Limit-Remaining': remaining, 'X-Rate-Limit-Reset': reset}
+            if not allowed:
+                return self.send_json(429, {'errorCode': 'E0000047', 'errorSummary': 'API call exceeded rate limit due to too many requests.'}, rate_limit_headers)
+
+        parts = path.split('/')[1:]
+        try:
+            if parts[:2] == ['api', 'v1'] and method == 'GET':
+                status, body, headers = self.okta(parts[2:])
+            elif parts[:2] == ['scim', '2']:
+                status, body, headers = self.scim(method, parts[2:])
+            else:
+                status, body, headers = 404, None, {}
+        except (IndexError, KeyError, ValueError):
+            status, body, headers = 404, None, {}
+        if status == 404 and body is None:
+            body = {'errorCode': 'E0000007', 'errorSummary': f'Not found: Resource not found: {path} (Unknown)'}
+        self.send_json(status, body, {**rate_limit_headers, **headers})
+
+    # Routes /api/v1/... Returns (status, body, headers).
+    def okta(self, parts):
+        org = self.server.org
+        if parts == ['users']:
+            login_filter = EXPRESSION_CLAUSE.fullmatch(self.query.get('filter', ''))
+            if login_filter and login_filter.groups()[:2] == ('profile.login', 'eq'):
+                user = org.logins.get(login_filter.group(3).lower())
+                return 200, [] if user is None else [org.user_json(user)], {}
+            matches = self.matcher({'profile.login': lambda user: org.login(user), 'id': lambda user: f'00u{user}', 'lastUpdated': lambda user: ORG_CREATED})
+            users = range(org.user_count) if matches is True else [user for user in range(org.user_count) if matches(user)]
+            return self.page(users, org.user_json)
+        if parts == ['groups']:
+            matches = self.matcher({'profile.name': lambda group: org.groups[group][1], 'id': lambda group: org.groups[group][0]})
+            groups = [group for group in range(len(org.groups)) if matches is True or matches(group)]
+            if 'q' in self.query:
+                groups = [group for group in groups if org.groups[group][1].startswith(self.query['q'])]
+            return self.page(groups, org.group_json)
+        if parts == ['apps']:
+            matches = self.matcher({'status': lambda app: org.apps[app][3], 'name': lambda app: org.apps[app][1]})
+            return self.page([app for app in range(len(org.apps)) if matches is True or matches(app)], org.app_json)
+        if parts == ['logs']:
+            matches = self.matcher({'eventType': lambda event: event['eventType']})
+            since, until = self.query.get('since', ''), self.query.get('until', '~')
+            return self.page([event for event in org.events if since <= event['published'] < until and (matches is True or matches(event))], lambda event: event)
+        if len(parts) == 2 and parts[0] == 'groups':
+            return 200, org.group_json(org.group_index[parts[1]]), {}
+        if len(parts) == 3 and parts[0] == 'users' and parts[2] == 'groups':
+            user = int(parts[1][len('00u'):])
+            return 200, [org.group_json(group) for group in org.user_groups[user]], {}
+        if len(parts) == 3 and parts[0] == 'groups':
+            group = org.group_index[parts[1]]
+            if parts[2] == 'users':
+                return self.page(org.group_members[group], org.user_json)
+            if parts[2] == 'apps':
+                return self.page(org.group_apps[group], org.app_json)
+        if len(parts) == 3 and parts[0] == 'apps' and parts[2] == 'users':
+            app = org.app_index[parts[1]]
+            return self.page(org.app_users(app), lambda item: org.app_user_json(*item))
+        return 404, None, {}
+
+    # Returns a predicate for the request's filter or search, True if it has neither, and raises
+    # ValueError (a 404 here, where Okta would say 400) for expressions we can't evaluate.
+    def matcher(self, fields):
+        expression = self.query.get('search') or self.query.get('filter')
+        if not expression:
+            return True
+        matches = expression_matcher(expression, fields)
+        if matches is None:
+            raise ValueError(expression)
+        return matches
+
+    # Hands out one page of items from the after cursor, with a Link header to the next page.
+    def page(self, items, to_json):
+        limit = min(int(self.query.get('limit') or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE)
+        start = int(self.query.get('after') or 0)
+        body = [to_json(item) for item in items[start:start + limit]]
+        url = urlsplit(self.path)
+        links = [f'<{self.server.base_url}{url.path}?{url.query}>; rel="self"']
+        if start + limit < len(items):
+            next_query = urlencode({**self.query, 'after': start + limit})
+            links.append(f'<{self.server.base_url}{url.path}?{next_query}>; rel="next"')
+        return 200, body, {'Link': ', '.join(links)}
+
+    # Routes /scim/2/... Returns (status, body, headers).
+    def scim(self, method, parts):
+        scim = self.server.scim
+        if parts == ['ServiceProviderConfig'] and method == 'GET':
+            return 200, {'bulk': {'supported': scim.bulk, 'maxOperations': SCIM_BULK_MAX_OPERATIONS, 'maxPayloadSize': 1048576}}, {}
+        if parts == ['Users'] and method == 'GET':
+            resources = scim.find(self.query.get('filter', ''))
+            return 200, {'schemas': ['urn:ietf:params:scim:api:messages:2.0:ListResponse'], 'totalResults': len(resources), 'Resources': resources}, {}
+        if parts == ['Users'] and method == 'POST':
+            status, body = scim.create(self.body or {})
+            return status, body, {}
+        if len(parts) == 2 and parts[0] == 'Users' and method == 'DELETE':
+            status = scim.delete(parts[1])
+            return status, None if status == 204 else {'detail': 'User not found'}, {}
+        if parts == ['Bulk'] and method == 'POST' and scim.bulk:
+            operations = (self.body or {}).get('Operations', [])
+            if len(operations) > SCIM_BULK_MAX_OPERATIONS:
+                return 413, {'detail': f'At most {SCIM_BULK_MAX_OPERATIONS} operations per request'}, {}
+            results = []
+            for operation in operations:
+                if operation.get('method') == 'POST' and operation.get('path') == '/Users':
+                    status, body = scim.create(operation.get('data') or {})
+                elif operation.get('method') == 'DELETE' and operation.get('path', '').startswith('/Users/'):
+                    status, body = scim.delete(operation['path'][len('/Users/'):]), None
+                else:
+                    status, body = 400, {'detail': 'Unsupported operation'}
+                result = {'method': operation.get('method'), 'bulkId': operation.get('bulkId'), 'status': str(status)}
+                if status >= 400:
+                    result['response'] = body
+                results.append(result)
+            return 200, {'schemas': ['urn:ietf:params:scim:api:messages:2.0:BulkResponse'], 'Operations': results}, {}
+        return 404, None, {}
+
+    def send_json(self, status, body, headers=None, counted=True):
+        data = b'' if body is None and status == 204 else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Date', formatdate(usegmt=True))
+        for name, value in (headers or {}).items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        self.wfile.write(data)
+        if counted:
+            self.server.stats.count(status, len(data))
+
+
+class MockOktaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=DEFAULT_PORT, org=None, rate_limit=None, latency=0.0, jitter=0.0, scim_bulk=False, verbose=False):
+        super().__init__(('127.0.0.1', port), MockOktaHandler)
+        self.org = org or MockOrg()
+        self.rate_limits = MockRateLimits(rate_limit) if rate_limit else None
+        self.latency = latency
+        self.jitter = jitter
+        self.scim = MockScim(bulk=scim_bulk)
+        self.stats = MockStats()
+        self.verbose = verbose
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Serves a synthetic Okta org and Quip SCIM API on localhost.")
+    parser.add_argument("--port", type = int, default = DEFAULT_PORT, help = "The port to listen on.")
+    parser.add_argument("--users", type = int, default = 1000, help = "How many users the org has.")
+    parser.add_argument("--apps", type = int, default = 600, help = "How many apps the org has.")
+    parser.add_argument("--domain", default = "example", help = "Users log in as first.last@{domain}.com.")
+    parser.add_argument("--latency", type = float, default = 0.0, help = "Seconds each request is held for.")
+    parser.add_argument("--jitter", type = float, default = 0.0, help = "Up to this many more seconds are added to each request at random.")
+    parser.add_argument("--rate-limit", type = int, default = 0, help = "Requests per minute allowed for each rate limit bucket. 0 turns rate limiting off.")
+    parser.add_argument("--scim-bulk", action = "store_true", help = "Advertise and serve SCIM /Bulk.")
+    parser.add_argument("--verbose", action = "store_true", help = "Log every request.")
+    args = parser.parse_args()
+
+    org = MockOrg(users = args.users, apps = args.apps, domain = args.domain)
+    server = MockOktaServer(args.port, org, args.rate_limit, args.latency, args.jitter, args.scim_bulk, args.verbose)
+    print(f"Serving {args.users} users on {server.base_url}", file=sys.stderr)
+    print(f"  OKTA_BASE_URL={server.base_url}", file=sys.stderr)
+    print(f"  QUIP_SCIM_URL={server.base_url}/scim/2", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import multiprocessing
+from urllib.request import urlopen
+
+# The scripts being measured live in the folders next to this one.
+OKTA_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+for folder in ('okta_client', 'okta_roles_in_group', 'users_added_directly_to_apps'):
+    sys.path.append(os.path.join(OKTA_FOLDER, folder))
+from mock_okta_server import MockOktaServer, MockOrg
+
+# Summary: Measures how the Okta scripts hold up as the org grows, against mock_okta_server rather
+# than a live tenant. For each org size it starts a mock server in its own process, then runs each
+# scenario in a fresh process of its own and reports the wall time, requests per second and peak
+# memory of that process. Results can be saved with --json and compared against a saved run with
+# --baseline, which fails if any scenario got slower than --tolerance allows.
+#
+#   pipeline  get_data_from_okta's pipeline over --logins users spread across the org
+#   census    okta_roles_in_group's role census of the org-000 group
+#   audit     users_added_directly_to_apps's direct assignment audit of every active app
+#   sync      the reporting suite's --sync: a full crawl into a snapshot, then an incremental sync
+
+SCENARIOS = ('pipeline', 'census', 'audit', 'sync')
+DEFAULT_SCALES = (1000, 10000, 100000)
+
+# The mock org's users log in as first{n}.last{n}@example.com.
+DOMAIN = 'example'
+
+# The group the census scenario counts the roles of.
+CENSUS_GROUP = 'org-000'
+
+
+def run_pipeline(client, users, logins, concurrency):
+    from okta_pipeline import OktaPipeline
+    step = max(1, users // logins)
+    names = (f'first{user}.last{user}' for user in range(0, users, step)[:logins])
+    return sum(1 for _ in OktaPipeline(client, DOMAIN, concurrency=concurrency).stream(names))
+
+
+def run_census(client, users, logins, concurrency):
+    from okta_roles_in_group import role_census
+    return len(role_census(client, client.find_group(CENSUS_GROUP).id))
+
+
+def run_audit(client, users, logins, concurrency):
+    from users_added_directly_to_apps import direct_assignments
+    return sum(1 for _ in direct_assignments(client))
+
+
+def run_sync(client, users, logins, concurrency):
+    from okta_sync import OktaSnapshot, OktaSync
+    snapshot = OktaSnapshot(':memory:')
+    sync = OktaSync(client, snapshot)
+    sync.sync()
+    sync.sync()
+    return snapshot.counts()['users']
+
+
+SCENARIO_FUNCTIONS = {'pipeline': run_pipeline, 'census': run_census, 'audit': run_audit, 'sync': run_sync}
+
+
+# The most memory this process has held at once, in MiB. Linux reports ru_maxrss in KiB, macOS in bytes.
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def serve(users, apps, latency, jitter, rate_limit, connection):
+    server = MockOktaServer(0, MockOrg(users = users, apps = apps, domain = DOMAIN), rate_limit, latency, jitter)
+    connection.send(server.base_url)
+    server.serve_forever()
+
+
+def run_scenario(scenario, base_url, users, logins, concurrency, connection):
+    from okta_client import OktaClient
+    client = OktaClient('benchmark', base_url=base_url, max_workers=concurrency)
+    started = time.perf_counter()
+    items = SCENARIO_FUNCTIONS[scenario](client, users, logins, concurrency)
+    connection.send({'items': items, 'wall_seconds': time.perf_counter() - started, 'peak_rss_mb': peak_rss_mb()})
+
+
+def mock_stats(base_url):
+    with urlopen(base_url + '/_mock/stats') as response:
+        return json.load(response)
+
+
+# Runs every scenario against one org size. Returns a result dict per scenario.
+def benchmark_scale(users, args):
+    context = multiprocessing.get_context('spawn')
+    receive, send = context.Pipe(duplex=False)
+    server = context.Process(target=serve, args=(users, args.apps, args.latency, args.jitter, args.rate_limit, send), daemon=True)
+    server.start()
+    base_url = receive.recv()
+    results = []
+    try:
+        for scenario in args.scenarios:
+            before = mock_stats(base_url)
+            receive, send = context.Pipe(duplex=False)
+            worker = context.Process(target=run_scenario, args=(scenario, base_url, users, args.logins, args.concurrency, send))
+            worker.start()
+            measured = receive.recv()
+            worker.join()
+            after = mock_stats(base_url)
+            requests = after['requests'] - before['requests']
+            results.append({
+                'scenario': scenario,
+                'users': users,
+                'items': measured['items'],
+                'requests': requests,
+                'rate_limited': after['rate_limited'] - before['rate_limited'],
+                'megabytes_received': round((after['bytes_sent'] - before['bytes_sent']) / (1024 * 1024), 1),
+                'wall_seconds': round(measured['wall_seconds'], 3),
+                'requests_per_second': round(requests / measured['wall_seconds'], 1) if measured['wall_seconds'] else None,
+                'peak_rss_mb': round(measured['peak_rss_mb'], 1),
+            })
+            print_result(results[-1])
+    finally:
+        server.terminate()
+    return results
+
+
+def print_header():
+    print(f"{'scenario':<10}{'users':>8}{'items':>9}{'requests':>10}{'429s':>6}{'MiB in':>8}{'wall s':>9}{'req/s':>9}{'peak MiB':>10}")
+
+
+def print_result(result):
+    print(f"{result['scenario']:<10}{result['users']:>8}{result['items']:>9}{result['requests']:>10}{result['rate_limited']:>6}"
+          f"{result['megabytes_received']:>8}{result['wall_seconds']:>9}{result['requests_per_second']:>9}{result['peak_rss_mb']:>10}")
+
+
+# Returns a line for every scenario that is slower than in the baseline by more than tolerance.
+def regressions(results, baseline, tolerance):
+    previous = {(result['scenario'], result['users']): result for result in baseline}
+    found = []
+    for result in results:
+        before = previous.get((result['scenario'], result['users']))
+        if before and result['wall_seconds'] > before['wall_seconds'] * (1 + tolerance):
+            found.append(f"{result['scenario']} at {result['users']} users took {result['wall_seconds']}s, was {before['wall_seconds']}s")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmarks the Okta scripts against a local mock Okta.")
+    parser.add_argument("--scales", type = int, nargs = "+", default = list(DEFAULT_SCALES), help = "The org sizes, in users, to run every scenario at.")
+    parser.add_argument("--scenarios", nargs = "+", choices = SCENARIOS, default = list(SCENARIOS), help = "Which scenarios to run.")
+    parser.add_argument("--logins", type = int, default = 1000, help = "How many users the pipeline scenario looks up.")
+    parser.add_argument("--apps", type = int, default = 600, help = "How many apps the mock org has.")
+    parser.add_argument("--concurrency", type = int, default = 10, help = "The most Okta API calls in flight at once.")
+    parser.add_argument("--latency", type = float, default = 0.02, help = "Seconds the mock holds each request for, to stand in for the network.")
+    parser.add_argument("--jitter", type = float, default = 0.0, help = "Up to this many more seconds are added to each request at random.")
+    parser.add_argument("--rate-limit", type = int, default = 0, help = "Requests per minute the mock allows each rate limit bucket. 0 turns rate limiting off.")
+    parser.add_argument("--json", help = "Write the results to this file.")
+    parser.add_argument("--baseline", help = "A file written by --json to compare the results against.")
+    parser.add_argument("--tolerance", type = float, default = 0.2, help = "How much slower than the baseline a scenario can be before it counts as a regression.")
+    args = parser.parse_args()
+
+    print_header()
+    results = []
+    for users in args.scales:
+        results.extend(benchmark_scale(users, args))
+
+    if args.json:
+        with open(args.json, 'w') as out:
+            json.dump(results, out, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            found = regressions(results, json.load(baseline), args.tolerance)
+        for line in found:
+            print(f"Regression: {line}", file=sys.stderr)
+        if found:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+from urllib.parse import urlsplit
+
+# Summary: A local SQLite cache of Okta API responses, so that running print_user_info and then
+# apply_rbac (or the reporting suite) over the same names.csv doesn't fetch everything from Okta
+# twice. Each entry keeps the response body, the next page link and the ETag Okta sent with it. Once
+# an entry is older than its TTL it is revalidated with If-None-Match rather than fetched blind.
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "okta", "okta_cache.sqlite3")
+
+# How long each kind of entry is trusted before we ask Okta again, in seconds. The first rule that
+# matches a url's path wins. Memberships and app assignments change far more often than ids do, and
+# the user listing (login lookups and scans of the org) has to pick up people who have just joined.
+DEFAULT_TTLS = [
+    (re.compile(r'^/api/v1/users$'), 10 * 60),
+    (re.compile(r'^/api/v1/users/[^/]+/groups'), 60 * 60),
+    (re.compile(r'^/api/v1/groups/[^/]+/apps'), 60 * 60),
+    (re.compile(r'^/api/v1/groups/[^/]+/users'), 60 * 60),
+    (re.compile(r'^/api/v1/users'), 24 * 60 * 60),
+    (re.compile(r'^/api/v1/groups'), 24 * 60 * 60),
+]
+DEFAULT_TTL = 60 * 60
+
+
+class OktaCacheMissError(Exception):
+    pass
+
+
+class OktaCache:
+    # refresh skips reading the cache (but still fills it). offline never talks to Okta, and serves
+    # whatever is cached no matter how old it is.
+    def __init__(self, path=DEFAULT_CACHE_PATH, refresh=False, offline=False, ttls=DEFAULT_TTLS):
+        self.path = path
+        self.refresh = refresh
+        self.offline = offline
+        self.ttls = ttls
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # One connection shared by every worker thread, guarded by a lock.
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS responses (url TEXT PRIMARY KEY, body TEXT, next_url TEXT, etag TEXT, fetched_at REAL)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS facts (key TEXT PRIMARY KEY, value TEXT)')
+
+    def ttl(self, url):
+        path = urlsplit(url).path
+        for pattern, ttl in self.ttls:
+            if pattern.match(path):
+                return ttl
+        return DEFAULT_TTL
+
+    # Returns the cached entry for a url as a dict, or None if we have never fetched it.
+    def lookup(self, url):
+        with self._lock:
+            row = self._db.execute('SELECT body, next_url, etag, fetched_at FROM responses WHERE url = ?', (url,)).fetchone()
+        if row is None:
+            return None
+        body, next_url, etag, fetched_at = row
+        return {'body': json.loads(body), 'next_url': next_url, 'etag': etag, 'fetched_at': fetched_at}
+
+    # An empty listing, such as a login lookup that found no one, is never fresh, so someone created
+    # since is found on the next run. Revalidating it with its ETag is still only a 304.
+    def is_fresh(self, url, entry):
+        return entry['body'] != [] and time.time() - entry['fetched_at'] < self.ttl(url)
+
+    def store(self, url, body, next_url, etag):
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)',
+                             (url, json.dumps(body), next_url, etag, time.time()))
+
+    # Okta answered a revalidation with 304 Not Modified, so the entry is good for another TTL.
+    def touch(self, url):
+        with self._lock, self._db:
+            self._db.execute('UPDATE responses SET fetched_at = ? WHERE url = ?', (time.time(), url))
+
+    # Small things learned about the org that are worth keeping between runs, such as how many users
+    # it has. Unlike responses, they are kept however old they are and read even with refresh.
+    def remember(self, key, value):
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO facts VALUES (?, ?)', (key, json.dumps(value)))
+
+    def recall(self, key):
+        with self._lock:
+            row = self._db.execute('SELECT value FROM facts WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def close(self):
+        with self._lock:
+            self._db.close()
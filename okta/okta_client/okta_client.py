@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+import os
+import time
+import threading
+import requests
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from urllib.parse import urlsplit
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
+from okta_cache import OktaCacheMissError
+
+# Summary: A shared Okta API client used by all of the Okta scripts. It keeps a single pooled
+# requests.Session so that every worker thread re-uses the open keep-alive connections to
+# {domain}.okta.com instead of paying for a fresh TCP and TLS handshake on every call. The list_*
+# methods page through a listing for you and yield slotted records rather than raw JSON.
+
+# The number of worker threads the scripts run by default, and so the number of pooled connections.
+DEFAULT_MAX_WORKERS = 10
+
+# How many times a single request is retried after a 429 before we give up on it.
+MAX_RATE_LIMIT_RETRIES = 6
+
+# The share of each rate limit window we leave untouched, so other tools using the same API token
+# (and the requests already in flight when we read the headers) don't push us over.
+RATE_LIMIT_HEADROOM = 0.1
+
+# The length of an Okta rate limit window in seconds, used until a response tells us the real reset time.
+RATE_LIMIT_WINDOW = 60
+
+# Set this to point every client at another Okta, such as the mock server in okta_benchmark, without
+# touching the scripts. A base_url passed to OktaClient still wins.
+BASE_URL_ENVIRONMENT_VARIABLE = 'OKTA_BASE_URL'
+
+# The groups our RBAC model is built from, and so the ones the GroupDirectory lists up front.
+GROUP_PREFIXES = ('role-', 'org-', 'team-')
+
+# The number of items we ask Okta for on each page of a listing. These are the most each endpoint
+# will return at once.
+USER_PAGE_SIZE = 200
+GROUP_PAGE_SIZE = 200
+GROUP_MEMBER_PAGE_SIZE = 1000
+APP_PAGE_SIZE = 200
+APP_USER_PAGE_SIZE = 500
+
+# Define a function to handle rate limit errors from the Okta API
+class OktaApiRateLimitError(Exception):
+    pass
+
+
+# Okta answered with an error other than 404 Not Found, such as a 401 for a bad API token or a 5xx.
+# The message carries Okta's errorSummary.
+class OktaApiError(Exception):
+    def __init__(self, url, status_code, summary):
+        super().__init__(f"Okta returned {status_code} for {url}: {summary}")
+        self.url = url
+        self.status_code = status_code
+        self.summary = summary
+
+    @classmethod
+    def from_response(cls, url, response):
+        try:
+            summary = response.json().get('errorSummary')
+        except (ValueError, AttributeError):
+            summary = None
+        return cls(url, response.status_code, summary or response.reason or 'no error summary')
+
+
+# These are the records the Okta scripts pass around instead of raw JSON. They are slotted so that
+# holding a whole org's worth of them doesn't cost a dict per record.
+# login is however the user was asked for: their Okta login, or the first.last name from names.csv.
+@dataclass(frozen=True, slots=True)
+class User:
+    id: str
+    login: str
+
+    @classmethod
+    def from_okta(cls, user):
+        return cls(user['id'], user['profile']['login'])
+
+
+@dataclass(frozen=True, slots=True)
+class Group:
+    id: str
+    name: str
+
+    @classmethod
+    def from_okta(cls, group):
+        return cls(group['id'], group['profile']['name'])
+
+
+@dataclass(frozen=True, slots=True)
+class App:
+    id: str
+    name: str
+    label: str
+    status: str
+
+    @classmethod
+    def from_okta(cls, app):
+        return cls(app['id'], app['name'], app['label'], app['status'])
+
+
+# A user assigned to an app, either directly (scope USER) or through a group (scope GROUP). user_name
+# is the username the app knows them by, which some apps don't have.
+@dataclass(frozen=True, slots=True)
+class AppUser:
+    app_id: str
+    user_id: str
+    user_name: str
+    scope: str
+
+    @classmethod
+    def from_okta(cls, app_id, app_user):
+        credentials = app_user.get('credentials') or {}
+        return cls(app_id, app_user['id'], credentials.get('userName'), app_user['scope'])
+
+
+# A user's membership of a role-, org- or team- group.
+@dataclass(frozen=True, slots=True)
+class GroupMembership:
+    user_id: str
+    group_id: str
+    group_name: str
+
+    @property
+    def kind(self):
+        return 'role' if self.group_name.startswith('role-') else 'orgteam'
+
+
+# An app a user gets through one of their org- or team- groups.
+@dataclass(frozen=True, slots=True)
+class AppAssignment:
+    user_id: str
+    group_id: str
+    app_name: str
+
+    kind = 'app'
+
+
+# Okta rate limits each endpoint separately, so /api/v1/users/{id}/groups and /api/v1/users?filter=
+# both count against /api/v1/users. This maps a url to the bucket it counts against.
+def rate_limit_bucket(url):
+    path = urlsplit(url).path
+    return '/'.join(path.split('/')[:4])
+
+
+# A process-wide token bucket for each Okta rate limit bucket. Every response tells us the bucket's
+# limit, how many requests are left in the current window and when the window resets. Workers take a
+# token before each request. Once half the window is spent the remaining tokens are spread evenly over
+# the time left, and when the bucket is empty every worker waits for the reset together instead of
+# each one firing requests into a 429 and sleeping on its own.
+class RateLimitGovernor:
+    def __init__(self, headroom=RATE_LIMIT_HEADROOM):
+        self.headroom = headroom
+        self._condition = threading.Condition()
+        self._buckets = {}
+        # When each bucket's last "nearly used up" message stops applying, so every waiting worker
+        # shares one message per window.
+        self._announced_until = {}
+
+    # Blocks until the bucket has a request to spare in the current window, then spends it. Returns
+    # how many seconds it waited on the rate limit, which is 0 if it never had to sleep.
+    def acquire(self, bucket):
+        started = time.monotonic()
+        slept = False
+        with self._condition:
+            while True:
+                state = self._buckets.get(bucket)
+                if state is None:
+                    return 0.0
+                now = time.monotonic()
+                if now >= state['reset_at']:
+                    # The window has rolled over, so we assume the full limit until a response tells
+                    # us the real numbers for the new window.
+                    state.update(remaining=state['limit'], reset_at=now + RATE_LIMIT_WINDOW, next_at=now, estimated=True)
+                # The headroom never holds back the last request of a bucket with a tiny limit.
+                spare = max(state['remaining'] - state['limit'] * self.headroom, min(state['remaining'], 1))
+                if spare >= 1 and now >= state['next_at']:
+                    state['remaining'] -= 1
+                    if state['remaining'] < state['limit'] / 2:
+                        state['next_at'] = now + (state['reset_at'] - now) / spare
+                    return now - started if slept else 0.0
+                wait_until = state['next_at'] if spare >= 1 else state['reset_at']
+                if spare < 1 and now >= self._announced_until.get(bucket, 0):
+                    print(f"Rate limit for {bucket} is nearly used up. Waiting {state['reset_at'] - now:.0f} seconds for it to reset...")
+                    self._announced_until[bucket] = state['reset_at']
+                self._condition.wait(wait_until - now)
+                slept = True
+
+    # Records the X-Rate-Limit-* headers from a response. The Reset header is in Okta's clock, so
+    # we measure it against the response's Date header rather than our own clock.
+    def update(self, bucket, response):
+        headers = response.headers
+        try:
+            server_now = parsedate_to_datetime(headers['Date']).timestamp()
+        except (KeyError, TypeError, ValueError):
+            server_now = time.time()
+        try:
+            limit = int(headers['X-Rate-Limit-Limit'])
+            remaining = int(headers['X-Rate-Limit-Remaining'])
+            reset = int(headers['X-Rate-Limit-Reset'])
+        except (KeyError, ValueError):
+            if response.status_code != 429:
+                return
+            # A 429 without the headers still means the bucket is empty for the rest of the window.
+            # The bucket keeps the limit we last saw for it.
+            with self._condition:
+                state = self._buckets.get(bucket)
+                limit = state['limit'] if state else 1
+            remaining, reset = 0, server_now + RATE_LIMIT_WINDOW
+        if response.status_code == 429:
+            remaining = 0
+        reset_at = time.monotonic() + max(reset - server_now, 0)
+
+        with self._condition:
+            state = self._buckets.get(bucket)
+            if state is None or state['estimated'] or reset_at > state['reset_at'] + 1:
+                # First real numbers for this bucket's current window.
+                self._buckets[bucket] = {'limit': limit, 'remaining': remaining, 'reset_at': reset_at,
+                                         'next_at': state['next_at'] if state else 0, 'estimated': False}
+            else:
+                # Responses from the same window come back out of order, so the lowest count wins.
+                state['limit'] = limit
+                state['remaining'] = min(state['remaining'], remaining)
+                if response.status_code == 429:
+                    # A 429 is Okta telling us exactly when the window opens again.
+                    state['reset_at'] = reset_at
+            self._condition.notify_all()
+
+
+# Shared by every OktaClient in the process, since they all spend the same org's rate limit.
+GOVERNOR = RateLimitGovernor()
+
+
+class OktaClient:
+    # The session is shared by all worker threads. The HTTPAdapter's connection pool is thread-safe,
+    # and it is sized to the worker count so that no thread has to open (and then throw away) an
+    # extra connection when all of them are busy at once.
+    # An OktaCache can be attached with cache=, and is then used for every get_json and paginate call.
+    # An OktaStats can be attached with stats=, and then records every request the client makes.
+    def __init__(self, api_key, domain=None, base_url=None, max_workers=DEFAULT_MAX_WORKERS, governor=GOVERNOR, cache=None, stats=None):
+        self.base_url = (base_url or os.environ.get(BASE_URL_ENVIRONMENT_VARIABLE) or f"https://{domain}.okta.com").rstrip('/')
+        self.max_workers = max_workers
+        self.governor = governor
+        self.cache = cache
+        self.stats = stats
+
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers, pool_block=True)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            'Accept': 'application/json',
+            'Content-Type': 'application/json',
+            'Accept-Encoding': 'gzip, deflate',
+            'Connection': 'keep-alive',
+            'Authorization': 'SSWS ' + api_key,
+        })
+
+    # Turns an API path like /api/v1/users into a full url. Full urls are passed through untouched.
+    def url(self, path):
+        if path.startswith(('https://', 'http://')):
+            return path
+        return self.base_url + path
+
+    # Every request goes through the rate limit governor. On a 429 the governor is told the bucket is
+    # empty until Okta's Reset time, so the retry waits exactly as long as it needs to.
+    def get(self, path, params=None, headers=None):
+        url = self.url(path)
+        bucket = rate_limit_bucket(url)
+        stats = self.stats
+        for _ in range(MAX_RATE_LIMIT_RETRIES):
+            waited = self.governor.acquire(bucket)
+            started = time.monotonic()
+            try:
+                response = self.session.get(url, params=params, headers=headers)
+            except requests.RequestException as error:
+                if stats is not None:
+                    stats.record_failure(url, error)
+                raise
+            self.governor.update(bucket, response)
+            if stats is not None:
+                stats.record_wait(bucket, waited)
+                stats.record_request(url, response.status_code, time.monotonic() - started, len(response.content))
+                if response.status_code == 429:
+                    stats.record_retry(url)
+                elif response.status_code >= 400 and response.status_code != 404:
+                    # A 404 is an answer (get_page turns it into None), like a group deleted mid-sync.
+                    stats.record_failure(response.url, f"HTTP {response.status_code}")
+            if response.status_code != 429:
+                return response
+        error = OktaApiRateLimitError(f"Exceeded rate limit for {bucket} after {MAX_RATE_LIMIT_RETRIES} retries")
+        if stats is not None:
+            stats.record_failure(url, error)
+        raise error
+
+    # Fetches one page and returns its decoded JSON body (None if Okta could not find what we asked
+    # for) along with the url of the next page, if there is one. Any other error raises OktaApiError.
+    # With a cache attached, fresh entries are served from it and stale ones are revalidated with
+    # their ETag.
+    def get_page(self, path, params=None):
+        url = requests.Request('GET', self.url(path), params=params).prepare().url
+        cache = self.cache
+        entry = None
+        if cache is not None and not cache.refresh:
+            entry = cache.lookup(url)
+            if cache.offline:
+                if entry is None:
+                    raise OktaCacheMissError(f"{url} is not in the cache and we are running offline")
+                if self.stats is not None:
+                    self.stats.record_cache_hit()
+                return entry['body'], entry['next_url']
+            if entry is not None and cache.is_fresh(url, entry):
+                if self.stats is not None:
+                    self.stats.record_cache_hit()
+                return entry['body'], entry['next_url']
+
+        headers = {'If-None-Match': entry['etag']} if entry is not None and entry['etag'] else None
+        response = self.get(url, headers=headers)
+        if response.status_code == 304:
+            cache.touch(url)
+            return entry['body'], entry['next_url']
+
+        if response.status_code >= 300 and response.status_code != 404:
+            raise OktaApiError.from_response(url, response)
+        body = None if response.status_code == 404 else response.json()
+        # The next link already carries the original query along with the after= cursor.
+        next_url = response.links.get('next', {}).get('url')
+        if cache is not None and response.status_code in (200, 404):
+            cache.store(url, body, next_url, response.headers.get('ETag'))
+        return body, next_url
+
+    # This is the API get request with the API token included. It returns the decoded JSON body, or
+    # None if Okta could not find what we asked for.
+    def get_json(self, path, params=None):
+        return self.get_page(path, params)[0]
+
+    # Follows Okta's Link: rel="next" cursors and yields the results one page at a time.
+    def paginate(self, path, params=None):
+        url = self.url(path)
+        while url:
+            page, url = self.get_page(url, params)
+            if page is None:
+                return
+            yield page
+            params = None
+
+    # Pages through many listings at once, for example the apps of every group in a list. Each
+    # listing follows its own Link cursors one page at a time, but the listings run in parallel on
+    # the client's workers. Results are yielded as (path, item) pairs as soon as their page arrives.
+    def paginate_many(self, paths, params=None):
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            in_flight = {executor.submit(self.get_page, path, params): path for path in paths}
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path = in_flight.pop(future)
+                    page, next_url = future.result()
+                    if next_url:
+                        in_flight[executor.submit(self.get_page, next_url)] = path
+                    for item in page or []:
+                        yield path, item
+
+    # Yields every item of a listing, across all of its pages.
+    def items(self, path, params=None):
+        for page in self.paginate(path, params):
+            yield from page
+
+    # These list methods page through a whole listing, yielding a record per item as each page arrives.
+    # search takes Okta's search expression syntax, e.g. 'profile.name sw "role-"'.
+    def list_users(self, search=None):
+        params = {'limit': USER_PAGE_SIZE, **({'search': search} if search else {})}
+        return map(User.from_okta, self.items('/api/v1/users', params))
+
+    def list_groups(self, search=None):
+        params = {'limit': GROUP_PAGE_SIZE, **({'search': search} if search else {})}
+        return map(Group.from_okta, self.items('/api/v1/groups', params))
+
+    # Returns the Group with exactly this name, or None. Unlike groups?q=, which is a prefix search,
+    # "team-eng" can never come back as "team-eng-oncall".
+    def find_group(self, name):
+        return next(self.list_groups(f'profile.name eq "{name}"'), None)
+
+    def list_group_users(self, group_id):
+        return map(User.from_okta, self.items(f'/api/v1/groups/{group_id}/users', {'limit': GROUP_MEMBER_PAGE_SIZE}))
+
+    def list_user_groups(self, user_id):
+        return map(Group.from_okta, self.items(f'/api/v1/users/{user_id}/groups'))
+
+    def list_apps(self, filter=None):
+        params = {'limit': APP_PAGE_SIZE, **({'filter': filter} if filter else {})}
+        return map(App.from_okta, self.items('/api/v1/apps', params))
+
+    def list_group_apps(self, group_id):
+        return map(App.from_okta, self.items(f'/api/v1/groups/{group_id}/apps', {'limit': APP_PAGE_SIZE}))
+
+    def list_app_users(self, app_id):
+        return (AppUser.from_okta(app_id, app_user) for app_user in self.items(f'/api/v1/apps/{app_id}/users', {'limit': APP_USER_PAGE_SIZE}))
+
+    def close(self):
+        self.session.close()
+
+
+# An exact-match index of Okta groups by name and by id, matched the same way as find_group. The first
+# lookup pages through every role-, org- and team- group once, and every lookup after that is a dict
+# lookup with no request at all.
+class GroupDirectory:
+    def __init__(self, client, prefixes=GROUP_PREFIXES):
+        self.client = client
+        self.prefixes = prefixes
+        self._lock = threading.Lock()
+        self._by_name = None
+        self._by_id = None
+
+    def load(self):
+        with self._lock:
+            if self._by_name is None:
+                search = ' or '.join(f'profile.name sw "{prefix}"' for prefix in self.prefixes)
+                by_name = {group.name: group for group in self.client.list_groups(search)}
+                self._by_id = {group.id: group for group in by_name.values()}
+                self._by_name = by_name
+        return self
+
+    # Returns the Group with an exact group name, or None if there is no such group. Names outside
+    # our prefixes aren't in the index, so they are looked up with an exact search instead.
+    def find(self, name):
+        if self._by_name is None:
+            self.load()
+        group = self._by_name.get(name)
+        if group is None and not name.startswith(self.prefixes):
+            group = self.client.find_group(name)
+            if group is not None:
+                with self._lock:
+                    self._by_name[name] = group
+                    self._by_id[group.id] = group
+        return group
+
+    def find_id(self, name):
+        group = self.find(name)
+        return group.id if group else None
+
+    def name_of(self, group_id):
+        if self._by_id is None:
+            self.load()
+        group = self._by_id.get(group_id)
+        return group.name if group else None
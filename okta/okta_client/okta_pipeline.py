@@ -0,0 +1,444 @@
+#!/usr/bin/env python3
+import sys
+import csv
+import queue
+import asyncio
+import threading
+from itertools import chain, islice
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from okta_client import OktaApiRateLimitError, GroupDirectory, User, GroupMembership, AppAssignment, USER_PAGE_SIZE, APP_PAGE_SIZE
+
+# Summary: The engine behind get_data_from_okta in the admin and reporting suites. Each user is run
+# through its own chain of lookups (user id -> groups -> group ids -> group apps), so a user's group
+# fetch starts as soon as their id comes back instead of waiting for every other user's id first.
+# All of the chains share one concurrency ceiling, and group lookups shared by several users are
+# only made once: group ids come from a directory of every role-, org- and team- group that is
+# listed a single time per run.
+#
+# The pipeline is a set of generator stages: read_logins -> OktaPipeline.stream -> unique_names.
+# Records come out of stream() as soon as they are found, and only a bounded number of users are
+# in flight at once, so memory stays flat no matter how long names.csv is.
+
+ROLE_PREFIX = 'role-'
+ORGTEAM_PREFIXES = ('org-', 'team-')
+
+# When we don't know how big the org is, this many names is where one filter query per name stops
+# being cheaper than listing every user once (about a 20,000 user org).
+USER_SCAN_THRESHOLD = 100
+
+# How OktaPipeline can turn logins into user ids. See OktaPipeline.__init__.
+USER_RESOLUTIONS = ('auto', 'query', 'scan')
+
+# The key the org's user count is remembered under in the OktaCache.
+ORG_SIZE_KEY = 'org_size'
+
+# How many users' chains can be running at once, as a multiple of the concurrency ceiling. A few
+# users per worker keeps every worker busy while one user waits on another's group lookup.
+USERS_IN_FLIGHT_PER_WORKER = 4
+
+# How many finished records can wait for the consumer before the pipeline stops starting new users.
+STREAM_BUFFER = 1000
+
+
+# Reads a CSV list of either First and Last names or e-mails (it can detect which one it is-- it can also
+# be a mixture of both), and yields each person once as a lower-case first.last login.
+def read_logins(path, domain):
+    seen = set()
+    with open(path) as csvfile:
+        for row in csv.reader(csvfile, delimiter=' '):
+            row = ('.'.join(row))
+            row = row.replace(f"@{domain}.com", "")
+            row = row.replace(",", "")
+            row = row.replace(" ", "")
+            login = row.lower()
+            if login and login not in seen:
+                seen.add(login)
+                yield login
+
+
+# Reads a CSV of user,new role rows (no header) into a dict of login -> new role group name. Users can
+# be given the same ways as in names.csv, and roles with or without the role- prefix. If a user is
+# listed more than once, the last row wins.
+def read_role_mapping(path, domain):
+    new_roles = {}
+    with open(path) as csvfile:
+        for row in csv.reader(csvfile):
+            if len(row) < 2 or not row[0].strip() or not row[1].strip():
+                continue
+            login = '.'.join(row[0].split()).replace(f"@{domain}.com", "").lower()
+            role = row[1].strip()
+            new_roles[login] = role if role.startswith(ROLE_PREFIX) else ROLE_PREFIX + role
+    return new_roles
+
+
+# Yields (kind, name) the first time each role, org/team group and app shows up in a stream of
+# records, where kind is 'role', 'orgteam' or 'app'.
+def unique_names(records):
+    seen = set()
+    for record in records:
+        if isinstance(record, GroupMembership):
+            key = (record.kind, record.group_name)
+        elif isinstance(record, AppAssignment):
+            key = (record.kind, record.app_name)
+        else:
+            continue
+        if key not in seen:
+            seen.add(key)
+            yield key
+
+
+# Collects the de-duplicated role, org/team group and app names from a stream of records, each in
+# the order they were first seen.
+def collect_names(records):
+    names = {'role': [], 'orgteam': [], 'app': []}
+    for kind, name in unique_names(records):
+        names[kind].append(name)
+    return names
+
+
+# Who has what, built from a stream of records. Each user keeps a set of group ids, and each group
+# keeps the set of apps it grants, so an app shared by a whole department is stored once per group
+# rather than once per person. Ids and names are interned so repeated strings share one copy.
+class AccessIndex:
+    def __init__(self):
+        self.logins = {}
+        self.user_groups = {}
+        self.group_names = {}
+        self.group_apps = {}
+
+    @classmethod
+    def from_records(cls, records):
+        index = cls()
+        for record in records:
+            index.add(record)
+        return index
+
+    def add(self, record):
+        if isinstance(record, User):
+            self.logins[record.id] = record.login
+            self.user_groups.setdefault(record.id, set())
+        elif isinstance(record, GroupMembership):
+            group_id = sys.intern(record.group_id)
+            self.group_names.setdefault(group_id, sys.intern(record.group_name))
+            self.user_groups.setdefault(record.user_id, set()).add(group_id)
+        elif isinstance(record, AppAssignment):
+            self.group_apps.setdefault(sys.intern(record.group_id), set()).add(sys.intern(record.app_name))
+
+    # Returns the role group names, org/team group names and app names of one user, each sorted.
+    def access_of(self, user_id):
+        roles, orgteams, apps = [], [], set()
+        for group_id in self.user_groups.get(user_id, ()):
+            name = self.group_names[group_id]
+            if name.startswith(ROLE_PREFIX):
+                roles.append(name)
+            else:
+                orgteams.append(name)
+                apps.update(self.group_apps.get(group_id, ()))
+        return sorted(roles), sorted(orgteams), sorted(apps)
+
+    # Yields (login, roles, orgteams, apps) for every user, in login order.
+    def users(self):
+        for user_id, login in sorted(self.logins.items(), key=lambda item: item[1]):
+            yield (login, *self.access_of(user_id))
+
+    # The de-duplicated role, org/team group and app names across every user, each sorted.
+    def names(self):
+        groups = sorted(self.group_names.values())
+        return {
+            'role': [group for group in groups if group.startswith(ROLE_PREFIX)],
+            'orgteam': [group for group in groups if not group.startswith(ROLE_PREFIX)],
+            'app': sorted(set().union(*self.group_apps.values())),
+        }
+
+    # Counts, for every org/team group, how many of its members hold each role. Returns the sorted
+    # role names (the columns) and a (group name, [count per role]) row for each org/team group.
+    def group_role_matrix(self):
+        counts = {}
+        for user_id in self.logins:
+            roles, orgteams, _ = self.access_of(user_id)
+            for group in orgteams:
+                row = counts.setdefault(group, {})
+                for role in roles:
+                    row[role] = row.get(role, 0) + 1
+        columns = sorted({role for row in counts.values() for role in row})
+        rows = [(group, [counts[group].get(role, 0) for role in columns]) for group in sorted(counts)]
+        return columns, rows
+
+
+# The lines of a per-user report: each user followed by their roles, org/team groups and apps.
+def user_report_lines(index):
+    for login, roles, orgteams, apps in index.users():
+        yield login
+        yield f"    roles:           {', '.join(roles) or '-'}"
+        yield f"    org/team groups: {', '.join(orgteams) or '-'}"
+        yield f"    apps:            {', '.join(apps) or '-'}"
+
+
+# The lines of a group-by-role matrix, as CSV: one row per org/team group, one column per role, and
+# the number of the group's members holding that role in each cell.
+def role_matrix_lines(index):
+    columns, rows = index.group_role_matrix()
+    yield ','.join(['group'] + columns)
+    for group, counts in rows:
+        yield ','.join([group] + [str(count) for count in counts])
+
+
+class OktaPipeline:
+    # The blocking Okta client calls run on a thread pool sized to the concurrency ceiling, so they
+    # still go through the client's pooled session and rate limit governor.
+    # user_resolution picks how logins are turned into user ids: 'query' makes one filter query per
+    # login, 'scan' lists every user in the org once and looks logins up in an index, and 'auto' picks
+    # whichever costs fewer requests for the number of logins and org_size. When org_size isn't
+    # given it comes from the client's cache, which remembers how many users the last scan found.
+    def __init__(self, client, domain, concurrency=None, user_resolution='auto', org_size=None):
+        self.client = client
+        self.domain = domain
+        self.concurrency = concurrency or client.max_workers
+        self.user_resolution = user_resolution
+        self.cache = getattr(client, 'cache', None)
+        if org_size is None and self.cache is not None:
+            org_size = self.cache.recall(ORG_SIZE_KEY)
+        self.org_size = org_size
+        self.errors = []
+        self.stats = getattr(client, 'stats', None)
+        self.groups = GroupDirectory(client)
+        self._group_directory = None
+        self._group_apps = {}
+        self._user_index = {}
+        self._user_waiters = {}
+        self._user_scan = None
+
+    # Runs every login through the pipeline, yielding User, GroupMembership and AppAssignment
+    # records as they are found. The event loop runs on its own thread and hands records over through
+    # a bounded queue, so a slow consumer holds the pipeline back instead of letting records pile up.
+    def stream(self, logins):
+        self._out = queue.Queue(maxsize=STREAM_BUFFER)
+        self._stopped = False
+        finished = object()
+
+        def run():
+            try:
+                asyncio.run(self._produce(logins))
+            except BaseException as exc:
+                if not self._stopped:
+                    self._out.put(exc)
+            finally:
+                if not self._stopped:
+                    self._out.put(finished)
+
+        threading.Thread(target=run, daemon=True).start()
+        done = False
+        try:
+            while True:
+                record = self._out.get()
+                if record is finished:
+                    done = True
+                    return
+                if isinstance(record, BaseException):
+                    done = True
+                    raise record
+                yield record
+        finally:
+            # If the consumer stops early, stop starting new users, cancel the ones in flight so they
+            # make no more requests, and unblock the producer.
+            self._stopped = True
+            if not done:
+                try:
+                    self._loop.call_soon_threadsafe(self._cancel)
+                except RuntimeError:
+                    # The loop already finished on its own.
+                    pass
+            while not self._out.empty():
+                self._out.get_nowait()
+
+    # Runs on the loop's own thread. Cancels the producer along with every user's chain and the
+    # lookups they share, and asyncio.run then waits for them all to wind down.
+    def _cancel(self):
+        for task in asyncio.all_tasks(self._loop):
+            task.cancel()
+
+    async def _produce(self, logins):
+        self._loop = asyncio.get_running_loop()
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        logins = iter(logins)
+
+        # Read just far enough ahead to know whether there are more logins than the scan threshold.
+        peek = list(islice(logins, self.scan_threshold() + 1))
+        self._use_scan = self.use_user_scan(len(peek))
+        logins = chain(peek, logins)
+
+        max_in_flight = self.concurrency * USERS_IN_FLIGHT_PER_WORKER
+        in_flight = set()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as self._executor:
+            for login in logins:
+                if self._stopped:
+                    break
+                if len(in_flight) >= max_in_flight:
+                    _, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                in_flight.add(asyncio.ensure_future(self._user_chain(login)))
+            if in_flight:
+                await asyncio.wait(in_flight)
+
+    async def _emit(self, record):
+        if self._stopped:
+            return
+        try:
+            self._out.put_nowait(record)
+        except queue.Full:
+            await self._loop.run_in_executor(None, self._out.put, record)
+
+    async def get(self, path, params=None):
+        async with self._semaphore:
+            return await self._loop.run_in_executor(self._executor, self.client.get_json, path, params)
+
+    # Starts fn(key) the first time a key is asked for, and hands every later caller the same task.
+    async def _once(self, cache, key, fn):
+        task = cache.get(key)
+        if task is None:
+            task = cache[key] = asyncio.ensure_future(fn(key))
+        return await task
+
+    # Times a stage of a user's chain into the client's stats, when it keeps any.
+    def stage(self, name):
+        return self.stats.stage(name) if self.stats is not None else nullcontext()
+
+    async def _user_chain(self, login):
+        try:
+            with self.stage('user id'):
+                user_id = await self.find_okta_user_id(login)
+            if user_id is None:
+                return
+            await self._emit(User(user_id, login))
+
+            with self.stage('user groups'):
+                roles, orgteams = await self.find_user_groups(user_id)
+            names = roles + orgteams
+            with self.stage('group ids'):
+                group_ids = await asyncio.gather(*(self.find_group_id(name) for name in names))
+            for name, group_id in zip(names, group_ids):
+                if group_id:
+                    await self._emit(GroupMembership(user_id, group_id, name))
+
+            orgteam_ids = [group_id for group_id in group_ids[len(roles):] if group_id]
+            with self.stage('group apps'):
+                for apps in asyncio.as_completed([self._group_apps_for(group_id) for group_id in orgteam_ids]):
+                    group_id, app_names = await apps
+                    for app_name in app_names:
+                        await self._emit(AppAssignment(user_id, group_id, app_name))
+        except Exception as exc:
+            self.errors.append(f'{login} generated an exception: {exc}')
+
+    async def _group_apps_for(self, group_id):
+        return group_id, await self._once(self._group_apps, group_id, self.find_group_apps)
+
+    # The most logins we need to look at before use_user_scan can make up its mind.
+    def scan_threshold(self):
+        if self.org_size is None:
+            return USER_SCAN_THRESHOLD
+        return -(-self.org_size // USER_PAGE_SIZE)
+
+    # Listing the org costs one request per page of users, where querying costs one request per login.
+    def use_user_scan(self, login_count):
+        if self.user_resolution != 'auto':
+            return self.user_resolution == 'scan'
+        return login_count > self.scan_threshold()
+
+    # Find the Okta user ID for a first.last login.
+    async def find_okta_user_id(self, login):
+        if self._use_scan:
+            return await self.find_okta_user_id_in_index(login)
+        params = {'filter': f'profile.login eq "{login}@{self.domain}.com"', 'fields': 'id'}
+        okta_user_data = await self.get('/api/v1/users', params)
+        if okta_user_data:
+            return okta_user_data[0]['id']
+        return None
+
+    # Looks a login up in the index built by scan_users. Logins the scan hasn't reached yet wait for it,
+    # so a user's chain carries on as soon as the page holding them arrives, not when the scan ends.
+    async def find_okta_user_id_in_index(self, login):
+        if self._user_scan is None:
+            self._user_scan = asyncio.ensure_future(self.scan_users())
+        full_login = f'{login}@{self.domain}.com'.lower()
+        user_id = self._user_index.get(full_login)
+        if user_id is not None:
+            return user_id
+        if self._user_scan.done():
+            # Raises the scan's error, if it failed.
+            await self._user_scan
+            return None
+        waiter = self._loop.create_future()
+        self._user_waiters.setdefault(full_login, []).append(waiter)
+        return await waiter
+
+    # Follows a listing's Link: rel="next" cursors, yielding each item as its page arrives. Pages of
+    # one listing come one after another, but any number of listings can be paged at the same time.
+    async def paginate(self, path, params=None):
+        pages = self.client.paginate(path, params)
+        while True:
+            async with self._semaphore:
+                page = await self._loop.run_in_executor(self._executor, next, pages, None)
+            if page is None:
+                return
+            for item in page:
+                yield item
+
+    # Streams the full /api/v1/users listing once, page by page, into a login -> id index.
+    async def scan_users(self):
+        try:
+            async for user in self.paginate('/api/v1/users', {'limit': USER_PAGE_SIZE}):
+                full_login = user['profile']['login'].lower()
+                self._user_index[full_login] = user['id']
+                for waiter in self._user_waiters.pop(full_login, []):
+                    waiter.set_result(user['id'])
+        except Exception as exc:
+            for waiters in self._user_waiters.values():
+                for waiter in waiters:
+                    waiter.set_exception(exc)
+            self._user_waiters.clear()
+            raise
+        # The scan just counted the org, so later runs can choose between scanning and querying.
+        if self.cache is not None and not self.cache.offline:
+            self.cache.remember(ORG_SIZE_KEY, len(self._user_index))
+        # Anyone still waiting isn't in Okta.
+        for waiters in self._user_waiters.values():
+            for waiter in waiters:
+                waiter.set_result(None)
+        self._user_waiters.clear()
+
+    # Find the role-, org-, and team- groups a user is in.
+    async def find_user_groups(self, user_id):
+        okta_user_group_data = await self.get(f'/api/v1/users/{user_id}/groups', {'fields': 'profile.name'})
+        role_list = []
+        user_orgteam_list = []
+        for group in okta_user_group_data or []:
+            name = group.get('profile', {}).get('name', '')
+            if name.startswith(ROLE_PREFIX):
+                role_list.append(name)
+            elif name.startswith(ORGTEAM_PREFIXES):
+                user_orgteam_list.append(name)
+        return list(dict.fromkeys(role_list)), list(dict.fromkeys(user_orgteam_list))
+
+    # Finds the Okta ID number of a group given its exact name. The group directory is loaded once,
+    # by whichever chain asks first, and every other lookup is answered from it.
+    async def find_group_id(self, groupname):
+        if self._group_directory is None:
+            self._group_directory = asyncio.ensure_future(self.load_group_directory())
+        await self._group_directory
+        return self.groups.find_id(groupname)
+
+    async def load_group_directory(self):
+        with self.stage('group directory'):
+            async with self._semaphore:
+                await self._loop.run_in_executor(self._executor, self.groups.load)
+
+    # This finds all of the apps that are associated with an org- or team- group, following Okta's
+    # limit/after cursors. Every group a user is in is paged at the same time.
+    async def find_group_apps(self, group_id):
+        apps = []
+        try:
+            async for app_data in self.paginate(f'/api/v1/groups/{group_id}/apps', {'limit': APP_PAGE_SIZE}):
+                apps.append(app_data['name'])
+        except OktaApiRateLimitError:
+            self.errors.append(f"Rate limit exceeded for group {group_id}")
+        return apps
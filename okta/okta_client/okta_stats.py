@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+import json
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+# Summary: Instrumentation for a run of the Okta scripts, so a slow run can be pinned on users, groups
+# or apps. Attach an OktaStats to an OktaClient with stats= and it records, for every endpoint, a
+# latency histogram, the status codes that came back, 429 retries and the size of the response bodies
+# (once decompressed, so gzip makes the wire traffic smaller), along with the time the rate limit
+# governor held requests back, cache hits and every url that failed. OktaPipeline
+# adds the wall time of each stage of a user's chain. The results print as a summary (--stats) or
+# are written as JSON or OpenMetrics text (--stats-file).
+
+# The upper bounds, in seconds, of the latency histogram buckets. Anything slower lands in +Inf.
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# How many failed urls the summary lists before it just gives the count.
+MAX_FAILED_URLS_SHOWN = 20
+
+
+# Turns a url into the endpoint it belongs to, with the id in it swapped out, so that every user's
+# /api/v1/users/{id}/groups call counts against the same endpoint.
+def endpoint_of(url):
+    segments = urlsplit(url).path.split('/')
+    if len(segments) > 4:
+        segments[4] = '{id}'
+    return '/'.join(segments)
+
+
+class OktaStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+        self.endpoints = {}
+        self.rate_limit_waits = {}
+        self.stages = {}
+        self.failed_urls = []
+        self.cache_hits = 0
+
+    def _endpoint(self, url):
+        endpoint = endpoint_of(url)
+        stats = self.endpoints.get(endpoint)
+        if stats is None:
+            stats = self.endpoints[endpoint] = {'requests': 0, 'statuses': {}, 'retries': 0, 'seconds': 0.0,
+                                                'max_seconds': 0.0, 'body_bytes': 0, 'buckets': [0] * (len(LATENCY_BUCKETS) + 1)}
+        return stats
+
+    def record_request(self, url, status, seconds, size):
+        with self._lock:
+            stats = self._endpoint(url)
+            stats['requests'] += 1
+            stats['statuses'][status] = stats['statuses'].get(status, 0) + 1
+            stats['seconds'] += seconds
+            stats['max_seconds'] = max(stats['max_seconds'], seconds)
+            stats['body_bytes'] += size
+            stats['buckets'][bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def record_retry(self, url):
+        with self._lock:
+            self._endpoint(url)['retries'] += 1
+
+    def record_wait(self, bucket, seconds):
+        if seconds <= 0:
+            return
+        with self._lock:
+            count, total = self.rate_limit_waits.get(bucket, (0, 0.0))
+            self.rate_limit_waits[bucket] = (count + 1, total + seconds)
+
+    def record_failure(self, url, reason):
+        with self._lock:
+            self.failed_urls.append((url, str(reason)))
+
+    def record_cache_hit(self):
+        with self._lock:
+            self.cache_hits += 1
+
+    # Times one run of a stage. Stages of different users overlap, so each stage keeps both the time
+    # spent in it summed over every run and its wall time, from the first run starting to the last
+    # one finishing.
+    @contextmanager
+    def stage(self, name):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            ended = time.monotonic()
+            with self._lock:
+                stats = self.stages.get(name)
+                if stats is None:
+                    stats = self.stages[name] = {'runs': 0, 'seconds': 0.0, 'first_start': started, 'last_end': ended}
+                stats['runs'] += 1
+                stats['seconds'] += ended - started
+                stats['first_start'] = min(stats['first_start'], started)
+                stats['last_end'] = max(stats['last_end'], ended)
+
+    def as_json(self):
+        with self._lock:
+            return {
+                'wall_seconds': round(time.monotonic() - self.started, 3),
+                'endpoints': {
+                    endpoint: {
+                        'requests': stats['requests'],
+                        'statuses': {str(status): count for status, count in sorted(stats['statuses'].items())},
+                        'retries': stats['retries'],
+                        'mean_seconds': round(stats['seconds'] / stats['requests'], 4) if stats['requests'] else None,
+                        'max_seconds': round(stats['max_seconds'], 4),
+                        'body_bytes': stats['body_bytes'],
+                        'latency_buckets': dict(zip([str(bound) for bound in LATENCY_BUCKETS] + ['+Inf'], stats['buckets'])),
+                    }
+                    for endpoint, stats in sorted(self.endpoints.items())
+                },
+                'rate_limit_waits': {bucket: {'waits': count, 'seconds': round(seconds, 3)}
+                                     for bucket, (count, seconds) in sorted(self.rate_limit_waits.items())},
+                'stages': {name: {'runs': stats['runs'], 'seconds': round(stats['seconds'], 3),
+                                  'wall_seconds': round(stats['last_end'] - stats['first_start'], 3)}
+                           for name, stats in self.stages.items()},
+                'cache_hits': self.cache_hits,
+                'failed_urls': [{'url': url, 'reason': reason} for url, reason in self.failed_urls],
+            }
+
+    # The --stats summary, as lines to print.
+    def summary_lines(self):
+        data = self.as_json()
+        lines = [f"Okta stats for a {data['wall_seconds']}s run ({data['cache_hits']} responses served from the cache)", ""]
+        lines.append(f"{'endpoint':<34}{'requests':>9}{'errors':>8}{'retries':>8}{'mean ms':>9}{'max ms':>9}{'body KiB':>10}")
+        for endpoint, stats in data['endpoints'].items():
+            # 404s are answers rather than errors; see OktaClient.get.
+            errors = sum(count for status, count in stats['statuses'].items() if int(status) >= 400 and status != '404')
+            mean_ms = round(stats['mean_seconds'] * 1000) if stats['mean_seconds'] is not None else '-'
+            lines.append(f"{endpoint:<34}{stats['requests']:>9}{errors:>8}{stats['retries']:>8}{mean_ms:>9}"
+                         f"{round(stats['max_seconds'] * 1000):>9}{stats['body_bytes'] // 1024:>10}")
+        if data['rate_limit_waits']:
+            lines.append("")
+            for bucket, waits in data['rate_limit_waits'].items():
+                lines.append(f"Waited {waits['seconds']}s on the rate limit for {bucket} ({waits['waits']} waits)")
+        if data['stages']:
+            lines.append("")
+            lines.append(f"{'stage':<34}{'runs':>9}{'wall s':>9}{'total s':>9}")
+            for name, stats in data['stages'].items():
+                lines.append(f"{name:<34}{stats['runs']:>9}{stats['wall_seconds']:>9}{stats['seconds']:>9}")
+        if data['failed_urls']:
+            lines.append("")
+            lines.append(f"{len(data['failed_urls'])} requests failed:")
+            for failure in data['failed_urls'][:MAX_FAILED_URLS_SHOWN]:
+                lines.append(f"  {failure['url']}: {failure['reason']}")
+            if len(data['failed_urls']) > MAX_FAILED_URLS_SHOWN:
+                lines.append(f"  ... and {len(data['failed_urls']) - MAX_FAILED_URLS_SHOWN} more")
+        return lines
+
+    # The same numbers in the OpenMetrics text format, for a Prometheus node exporter's textfile
+    # collector or anything else that reads it.
+    def openmetrics(self):
+        data = self.as_json()
+        lines = [
+            '# TYPE okta_request_duration_seconds histogram',
+            '# UNIT okta_request_duration_seconds seconds',
+        ]
+        with self._lock:
+            histograms = [(endpoint, stats['buckets'][:], stats['requests'], stats['seconds']) for endpoint, stats in sorted(self.endpoints.items())]
+        for endpoint, buckets, requests, seconds in histograms:
+            cumulative = 0
+            for bound, count in zip([str(bound) for bound in LATENCY_BUCKETS] + ['+Inf'], buckets):
+                cumulative += count
+                lines.append(f'okta_request_duration_seconds_bucket{{endpoint="{endpoint}",le="{bound}"}} {cumulative}')
+            lines.append(f'okta_request_duration_seconds_count{{endpoint="{endpoint}"}} {requests}')
+            lines.append(f'okta_request_duration_seconds_sum{{endpoint="{endpoint}"}} {seconds}')
+        lines.append('# TYPE okta_responses counter')
+        for endpoint, stats in data['endpoints'].items():
+            for status, count in stats['statuses'].items():
+                lines.append(f'okta_responses_total{{endpoint="{endpoint}",status="{status}"}} {count}')
+        lines.append('# TYPE okta_retries counter')
+        for endpoint, stats in data['endpoints'].items():
+            lines.append(f'okta_retries_total{{endpoint="{endpoint}"}} {stats["retries"]}')
+        lines.append('# TYPE okta_response_body_bytes counter')
+        for endpoint, stats in data['endpoints'].items():
+            lines.append(f'okta_response_body_bytes_total{{endpoint="{endpoint}"}} {stats["body_bytes"]}')
+        lines.append('# TYPE okta_rate_limit_wait_seconds counter')
+        for bucket, waits in data['rate_limit_waits'].items():
+            lines.append(f'okta_rate_limit_wait_seconds_total{{bucket="{bucket}"}} {waits["seconds"]}')
+        lines.append('# TYPE okta_stage_wall_seconds gauge')
+        for name, stats in data['stages'].items():
+            lines.append(f'okta_stage_wall_seconds{{stage="{name}"}} {stats["wall_seconds"]}')
+        lines.append('# TYPE okta_cache_hits counter')
+        lines.append(f'okta_cache_hits_total {data["cache_hits"]}')
+        lines.append('# TYPE okta_failed_requests counter')
+        lines.append(f'okta_failed_requests_total {len(data["failed_urls"])}')
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+    # Writes the stats to a file: JSON if its name ends in .json, OpenMetrics text otherwise.
+    def write(self, path):
+        with open(path, 'w') as out:
+            if path.endswith('.json'):
+                json.dump(self.as_json(), out, indent=1)
+            else:
+                out.write(self.openmetrics())
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+from okta_client import User, Group, GroupMembership, AppAssignment, USER_PAGE_SIZE, APP_PAGE_SIZE, GROUP_MEMBER_PAGE_SIZE, GROUP_PREFIXES
+
+# Summary: Incremental sync of the whole org's user -> group -> app graph into a local SQLite snapshot.
+# The first sync crawls every user, every role-, org- and team- group, their members and the apps of
+# the org- and team- groups. Every sync after that only asks Okta what changed since the last
+# checkpoint: users updated since then (/api/v1/users?search=lastUpdated gt ...) and the membership,
+# group and app assignment events in the System Log (/api/v1/logs), and patches the snapshot in
+# place. A nightly report over the whole org then costs a handful of requests instead of a crawl.
+#
+# The snapshot hands back the same User, GroupMembership and AppAssignment records that
+# get_data_from_okta streams, so AccessIndex and the reports work on either.
+
+DEFAULT_SNAPSHOT_PATH = os.path.join(os.path.expanduser("~"), ".cache", "okta", "okta_snapshot.sqlite3")
+
+ROLE_PREFIX = 'role-'
+
+# Okta only keeps the System Log for 90 days. A snapshot whose checkpoint is older than that can't
+# be caught up from the log, so it is crawled again from scratch.
+LOG_RETENTION = timedelta(days=90)
+
+# Events can take a little while to show up in the System Log, so each sync only reads the log up to
+# this long ago. Anything newer is picked up by the next sync.
+SYNC_LAG = timedelta(minutes=1)
+
+# The most events /api/v1/logs hands out per page.
+LOG_PAGE_SIZE = 1000
+
+# The System Log events that change who has what.
+MEMBERSHIP_EVENTS = ('group.user_membership.add', 'group.user_membership.remove')
+APP_ASSIGNMENT_EVENTS = ('group.application_assignment.add', 'group.application_assignment.remove', 'group.application_assignment.update')
+GROUP_EVENTS = ('group.lifecycle.create', 'group.lifecycle.delete', 'group.profile.update')
+USER_EVENTS = ('user.lifecycle.delete.initiated',)
+SYNC_EVENTS = MEMBERSHIP_EVENTS + APP_ASSIGNMENT_EVENTS + GROUP_EVENTS + USER_EVENTS
+
+
+# Okta's timestamp format, which both lastUpdated searches and the System Log's since/until take.
+def okta_timestamp(moment):
+    return moment.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+
+def parse_okta_timestamp(text):
+    return datetime.strptime(text, '%Y-%m-%dT%H:%M:%S.%fZ').replace(tzinfo=timezone.utc)
+
+
+# An event's first target of the given type (User, UserGroup or AppInstance), if it has one.
+def event_target(event, target_type):
+    for target in event.get('target') or ():
+        if target.get('type') == target_type:
+            return target
+    return None
+
+
+class OktaSnapshot:
+    def __init__(self, path=DEFAULT_SNAPSHOT_PATH, prefixes=GROUP_PREFIXES):
+        self.path = path
+        self.prefixes = prefixes
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS users (id TEXT PRIMARY KEY, login TEXT)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS groups (id TEXT PRIMARY KEY, name TEXT)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS memberships (user_id TEXT, group_id TEXT, PRIMARY KEY (user_id, group_id))')
+            self._db.execute('CREATE TABLE IF NOT EXISTS group_apps (group_id TEXT, app_name TEXT, PRIMARY KEY (group_id, app_name))')
+
+    # The time the snapshot is up to date to, or None if it has never been synced.
+    @property
+    def checkpoint(self):
+        with self._lock:
+            row = self._db.execute("SELECT value FROM meta WHERE key = 'checkpoint'").fetchone()
+        return parse_okta_timestamp(row[0]) if row else None
+
+    # The id -> name of every group in the snapshot.
+    def group_names(self):
+        with self._lock:
+            return dict(self._db.execute('SELECT id, name FROM groups'))
+
+    def counts(self):
+        with self._lock:
+            return {table: self._db.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                    for table in ('users', 'groups', 'memberships', 'group_apps')}
+
+    # Replaces the whole snapshot with a fresh crawl, in one transaction.
+    def replace(self, checkpoint, users, groups, memberships, group_apps):
+        with self._lock, self._db:
+            for table in ('users', 'groups', 'memberships', 'group_apps'):
+                self._db.execute(f'DELETE FROM {table}')
+            self._db.executemany('INSERT OR REPLACE INTO users VALUES (?, ?)', users)
+            self._db.executemany('INSERT OR REPLACE INTO groups VALUES (?, ?)', groups)
+            self._db.executemany('INSERT OR IGNORE INTO memberships VALUES (?, ?)', memberships)
+            self._db.executemany('INSERT OR IGNORE INTO group_apps VALUES (?, ?)', group_apps)
+            self._set_checkpoint(checkpoint)
+
+    # Patches the snapshot with the changes one incremental sync found, in one transaction, so a
+    # failed sync leaves the snapshot and its checkpoint as they were. Events are applied in the
+    # order Okta logged them. renamed maps group ids to their current Group (None if it is gone),
+    # group_members maps the groups that were just renamed into our prefixes to their members, and
+    # group_apps maps group ids to their current app names.
+    def patch(self, checkpoint, users, removed_users, events, renamed, group_members, group_apps):
+        with self._lock, self._db:
+            self._db.executemany('INSERT OR REPLACE INTO users VALUES (?, ?)', users)
+            for user_id in removed_users:
+                self._db.execute('DELETE FROM users WHERE id = ?', (user_id,))
+            for event in events:
+                self._apply(event)
+            for group_id, group in renamed.items():
+                if group is None or not group.name.startswith(self.prefixes):
+                    self._remove_group(group_id)
+                else:
+                    self._db.execute('INSERT OR REPLACE INTO groups VALUES (?, ?)', (group.id, group.name))
+            for group_id, user_ids in group_members.items():
+                self._db.execute('DELETE FROM memberships WHERE group_id = ?', (group_id,))
+                self._db.executemany('INSERT OR IGNORE INTO memberships VALUES (?, ?)', [(user_id, group_id) for user_id in user_ids])
+            for group_id, app_names in group_apps.items():
+                self._db.execute('DELETE FROM group_apps WHERE group_id = ?', (group_id,))
+                self._db.executemany('INSERT OR IGNORE INTO group_apps SELECT id, ? FROM groups WHERE id = ?',
+                                     [(app_name, group_id) for app_name in app_names])
+            self._set_checkpoint(checkpoint)
+
+    def _apply(self, event):
+        event_type = event['eventType']
+        group = event_target(event, 'UserGroup')
+        user = event_target(event, 'User')
+        if event_type == 'group.user_membership.add' and group and user:
+            # Only groups we track are kept, and a group created since the last sync is already in
+            # the table by the time its members are added.
+            self._db.execute('INSERT OR IGNORE INTO memberships SELECT ?, id FROM groups WHERE id = ?', (user['id'], group['id']))
+        elif event_type == 'group.user_membership.remove' and group and user:
+            self._db.execute('DELETE FROM memberships WHERE user_id = ? AND group_id = ?', (user['id'], group['id']))
+        elif event_type == 'group.lifecycle.create' and group and (group.get('displayName') or '').startswith(self.prefixes):
+            self._db.execute('INSERT OR REPLACE INTO groups VALUES (?, ?)', (group['id'], group['displayName']))
+        elif event_type == 'group.lifecycle.delete' and group:
+            self._remove_group(group['id'])
+        elif event_type == 'user.lifecycle.delete.initiated' and user:
+            self._db.execute('DELETE FROM users WHERE id = ?', (user['id'],))
+            self._db.execute('DELETE FROM memberships WHERE user_id = ?', (user['id'],))
+
+    def _remove_group(self, group_id):
+        self._db.execute('DELETE FROM groups WHERE id = ?', (group_id,))
+        self._db.execute('DELETE FROM memberships WHERE group_id = ?', (group_id,))
+        self._db.execute('DELETE FROM group_apps WHERE group_id = ?', (group_id,))
+
+    def _set_checkpoint(self, checkpoint):
+        self._db.execute("INSERT OR REPLACE INTO meta VALUES ('checkpoint', ?)", (okta_timestamp(checkpoint),))
+
+    # Yields every user's records the way get_data_from_okta does: the User, then a GroupMembership
+    # for each role-, org- and team- group, then an AppAssignment for each app of their org- and
+    # team- groups. Logins are given as first.last, like names.csv, when they are in domain.
+    def records(self, domain=None):
+        with self._lock:
+            groups = dict(self._db.execute('SELECT id, name FROM groups'))
+            group_apps = {}
+            for group_id, app_name in self._db.execute('SELECT group_id, app_name FROM group_apps ORDER BY app_name'):
+                group_apps.setdefault(group_id, []).append(app_name)
+            user_groups = {}
+            for user_id, group_id in self._db.execute('SELECT user_id, group_id FROM memberships'):
+                if group_id in groups:
+                    user_groups.setdefault(user_id, []).append(group_id)
+            users = self._db.execute('SELECT id, login FROM users ORDER BY login').fetchall()
+
+        suffix = f'@{domain}.com' if domain else None
+        for user_id, login in users:
+            if suffix and login.endswith(suffix):
+                login = login[:-len(suffix)]
+            yield User(user_id, login)
+            group_ids = sorted(user_groups.get(user_id, ()), key=lambda group_id: (not groups[group_id].startswith(ROLE_PREFIX), groups[group_id]))
+            for group_id in group_ids:
+                yield GroupMembership(user_id, group_id, groups[group_id])
+            for group_id in group_ids:
+                if not groups[group_id].startswith(ROLE_PREFIX):
+                    for app_name in group_apps.get(group_id, ()):
+                        yield AppAssignment(user_id, group_id, app_name)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+# Brings an OktaSnapshot up to date. Give it a client without an OktaCache: a sync is only as
+# current as the answers it gets.
+class OktaSync:
+    def __init__(self, client, snapshot):
+        self.client = client
+        self.snapshot = snapshot
+
+    # Syncs the snapshot, crawling the whole org when full is set, the snapshot is empty or its
+    # checkpoint has fallen out of the System Log. Returns what was done, for printing.
+    def sync(self, full=False):
+        now = datetime.now(timezone.utc)
+        since = self.snapshot.checkpoint
+        if full or since is None or now - since > LOG_RETENTION:
+            return self.full_sync(now - SYNC_LAG)
+        return self.incremental_sync(since, now - SYNC_LAG)
+
+    def full_sync(self, checkpoint):
+        client = self.client
+        users = [(user['id'], user['profile']['login'].lower()) for user in client.items('/api/v1/users', {'limit': USER_PAGE_SIZE})]
+        search = ' or '.join(f'profile.name sw "{prefix}"' for prefix in self.snapshot.prefixes)
+        groups = [(group.id, group.name) for group in client.list_groups(search)]
+
+        members = {f'/api/v1/groups/{group_id}/users': group_id for group_id, _ in groups}
+        memberships = [(user['id'], members[path]) for path, user in client.paginate_many(members, {'limit': GROUP_MEMBER_PAGE_SIZE})]
+
+        orgteams = {f'/api/v1/groups/{group_id}/apps': group_id for group_id, name in groups if not name.startswith(ROLE_PREFIX)}
+        group_apps = [(orgteams[path], app['name']) for path, app in client.paginate_many(orgteams, {'limit': APP_PAGE_SIZE})]
+
+        self.snapshot.replace(checkpoint, users, groups, memberships, group_apps)
+        return {'sync': 'full', 'users': len(users), 'groups': len(groups), 'memberships': len(memberships), 'group_apps': len(group_apps)}
+
+    def incremental_sync(self, since, until):
+        client = self.client
+        # Users created, renamed or deactivated since the checkpoint. The full crawl's user listing
+        # leaves out deprovisioned users, so they are dropped here too.
+        users, removed_users = [], []
+        for user in client.items('/api/v1/users', {'search': f'lastUpdated gt "{okta_timestamp(since)}"', 'limit': USER_PAGE_SIZE}):
+            if user['status'] == 'DEPROVISIONED':
+                removed_users.append(user['id'])
+            else:
+                users.append((user['id'], user['profile']['login'].lower()))
+
+        # A bounded (since and until) System Log query, so its next links run out once it is read.
+        events = []
+        params = {'since': okta_timestamp(since), 'until': okta_timestamp(until), 'sortOrder': 'ASCENDING', 'limit': LOG_PAGE_SIZE,
+                  'filter': ' or '.join(f'eventType eq "{event_type}"' for event_type in SYNC_EVENTS)}
+        for page in client.paginate('/api/v1/logs', params):
+            if not page:
+                break
+            events.extend(page)
+
+        # Renamed groups and groups whose app assignments changed are looked up again rather than
+        # patched from the event, which names the app by its label and not the name we report on.
+        names = self.snapshot.group_names()
+        renamed = {}
+        changed_apps = set()
+        for event in events:
+            group = event_target(event, 'UserGroup')
+            if group is None:
+                continue
+            if event['eventType'] == 'group.lifecycle.create':
+                names[group['id']] = group.get('displayName') or ''
+            elif event['eventType'] == 'group.profile.update':
+                renamed[group['id']] = None
+            elif event['eventType'] in APP_ASSIGNMENT_EVENTS:
+                changed_apps.add(group['id'])
+
+        # A group renamed into our prefixes is new to the snapshot, so its members and apps are read
+        # in full. Its earlier membership events were skipped while it was untracked.
+        new_groups = []
+        for group_id in renamed:
+            group = client.get_json(f'/api/v1/groups/{group_id}')
+            renamed[group_id] = group = Group.from_okta(group) if group else None
+            if group is not None and group.name.startswith(self.snapshot.prefixes):
+                if group_id not in names:
+                    new_groups.append(group_id)
+                    changed_apps.add(group_id)
+                names[group_id] = group.name
+        members = {f'/api/v1/groups/{group_id}/users': group_id for group_id in new_groups}
+        group_members = {group_id: [] for group_id in new_groups}
+        for path, user in client.paginate_many(members, {'limit': GROUP_MEMBER_PAGE_SIZE}):
+            group_members[members[path]].append(user['id'])
+
+        orgteams = [group_id for group_id in changed_apps if group_id in names and not names[group_id].startswith(ROLE_PREFIX)]
+        apps = {f'/api/v1/groups/{group_id}/apps': group_id for group_id in orgteams}
+        group_apps = {group_id: [] for group_id in orgteams}
+        for path, app in client.paginate_many(apps, {'limit': APP_PAGE_SIZE}):
+            group_apps[apps[path]].append(app['name'])
+
+        self.snapshot.patch(until, users, removed_users, events, renamed, group_members, group_apps)
+        return {'sync': 'incremental', 'since': okta_timestamp(since), 'users': len(users) + len(removed_users),
+                'events': len(events), 'groups_refetched': len(renamed) + len(new_groups) + len(orgteams)}
@@ -1,207 +1,105 @@
 #!bin/bash/python
+import os
+import sys
 import csv
-import time
-import requests
+import json
+import argparse
+from itertools import zip_longest
 from sensitive import api_key
 from sensitive import domain
-from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# The shared Okta client lives in the okta_client folder next to this one.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'okta_client'))
+from okta_client import OktaClient, OktaApiError
+from okta_cache import OktaCache
+from okta_stats import OktaStats
+from okta_sync import OktaSnapshot, OktaSync
+from okta_pipeline import OktaPipeline, AccessIndex, USER_RESOLUTIONS, read_logins, unique_names, collect_names, user_report_lines, role_matrix_lines
 
 # Summary: This code connects to the Okta API and retrieves user data, 
 # group data, and group assigned application data for a specified domain, as well as 
-# cleaning up a CSV file of user data.
-
-# A list of variables to hold user data from the Okta API
-HUMAN_FILES = []
-OKTA_USER_IDS = []
-USER_ROLE_GROUPS = []
-USER_ORGTEAM_GROUPS = []
-USER_ORGTEAM_GROUP_IDS = []
-USER_ORGTEAM_ASSOCIATED_APPS = []
-
-# Define a function to handle rate limit errors from the Okta API
-class OktaApiRateLimitError(Exception):
-    pass
-
-# This function just cleans up the data in our names.csv file, and adds the first.last of each user to
-# the human_files array.
-def input_cleanup():
-    user_list = []
-    # Reads a CSV list of either First and Last names or e-mails (it can detect which one it is-- it can also be a mixture of both),
-    # and adds them to the user_list variable in a first.last format:
-    with open('names.csv') as csvfile:
-        file = csv.reader(csvfile, delimiter=' ')
-        for row in file:
-            row = ('.'.join(row))
-            row = row.replace(f"@{domain}.com", "")
-            row = row.replace(",", "")
-            row = row.replace(" ", "")
-            user_list.append(row)
-
-    # Lower-cases our list of name and assigns them to the human_files variable:
-    for user in user_list:
-        lowercase = user.lower()
-        HUMAN_FILES.append(lowercase)
-
-input_cleanup()
-
-# This is the API get request with the API token included. The urls can be swapped depending on what API call we're trying to make,
-# but it is important to user this function for get requests because it the function the multi-threading references. The delay is the 
-# time that it waits between requests.
-
-def okta_get_request(url):
-    headers = {'Authorization': 'SSWS' + api_key}
-    response = requests.get(url, headers=headers)
-    data = response.json()
-    if response.status_code == 404:
-        return None
-    elif response.status_code == 429:
-        retries = 0
-        while retries < 6:  # set the maximum number of retries to 6
-            wait_time = 2 ** retries  # exponential wait time
-            print(f"Exceeded rate limit. Waiting for {wait_time} seconds before retrying...")
-            time.sleep(wait_time)
-            response = requests.get(url, headers=headers)
-            data = response.json()
-            if response.status_code == 429:
-                retries += 1
-            else:
-                break
-        else:
-            raise OktaApiRateLimitError("Exceeded rate limit after 5 retries")
-    return data
+# cleaning up a CSV file of user data. Run it with no arguments for the interactive menu, or with
+# --format to write every report in one pass for scheduled jobs. With --sync the reports cover the
+# whole org, read from a local snapshot that each run only patches with what changed in Okta.
 
+# The most Okta API calls we have in flight at once. The client's connection pool is sized to match.
+MAX_WORKERS = 10
 
-# Find Okta user IDs for each user in the HUMAN_FILES list
-def find_okta_user_ids():
+# The machine-readable formats the batch mode can write. jsonl and csv write one (report, name) row
+# per line as soon as each name is first found. columnar writes one column per report, so it has to
+# wait for the whole run to finish.
+REPORT_FORMATS = ('jsonl', 'csv', 'columnar')
 
-    user_object_url_list = []
-    fields = 'id'
-    limit = 200
-    offset = 0
-    while True:
-        # Create a list of Okta API URLs to retrieve user data for each user in the HUMAN_FILES list, with pagination
-        for user in HUMAN_FILES:
-            user_object_url_list.append(f'https://{domain}.okta.com/api/v1/users?filter=profile.login%20eq%20%22{user}@{domain}.com%22&fields={fields}&limit={limit}&offset={offset}')
-        # Use ThreadPoolExecutor to asynchronously execute Okta API GET requests for each user URL
-        with ThreadPoolExecutor(max_workers=10) as executor:
-            future_to_url = {executor.submit(okta_get_request, url): url for url in user_object_url_list}
-            for future in as_completed(future_to_url):
-                url = future_to_url[future]
-                try:
-                    okta_user_data = future.result()
-                    if bool(okta_user_data) == True:
-                        user_id = okta_user_data[0]['id']
-                        OKTA_USER_IDS.append(user_id)
-                except Exception as exc:
-                    exceptions = f'{url} generated an exception: {exc}'
-
-        if len(okta_user_data) < limit:
-            break
-        offset += limit
-        user_object_url_list.clear()  
-
-# Find the associated role-, org-, and team- groups a user is in.
-def find_user_role_groups():
-    user_role_url_list = []
-
-    for id in OKTA_USER_IDS:
-        user_role_url_list.append(f"https://{domain}.okta.com/api/v1/users/{id}/groups?fields=profile.name")
-
-    # Use ThreadPoolExecutor to asynchronously execute Okta API GET requests for each group URL
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        future_to_url = {executor.submit(okta_get_request, url): url for url in user_role_url_list}
-        for future in as_completed(future_to_url):
-            url = future_to_url[future]
-            try:
-                okta_user_group_data = future.result()
-
-                role_list = []
-                user_orgteam_list = []
-
-                # Iterate through each group in the list
-                for group in okta_user_group_data:
-                    if group.get('profile', {}).get('name', '').startswith('role-'):
-                        role_list.append(group['profile']['name'])
-                    elif group.get('profile', {}).get('name', '').startswith(('org-', 'team-')):
-                        user_orgteam_list.append(group['profile']['name'])
-
-
-                USER_ORGTEAM_GROUPS.extend(set(user_orgteam_list))
-                USER_ROLE_GROUPS.extend(set(role_list))
-            except Exception as exc:
-                exceptions = f'{url} generated an exception: {exc}'
-
-# Finds the Okta ID number of a group given its name.
-def find_group_ids():
-    group_ids_url_list = []
-
-    fields = 'apps'
-
-    set_user_orgteam_groups = set(USER_ORGTEAM_GROUPS)
-    for groupname in set_user_orgteam_groups:
-        group_ids_url_list.append(f"https://{domain}.okta.com/api/v1/groups?q={groupname}&fields={fields}")
-
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        future_to_url = {executor.submit(okta_get_request, url): url for url in group_ids_url_list}
-        for future in as_completed(future_to_url):
-            url = future_to_url[future]
-            try:
-                okta_group_data = future.result()
-                if bool(okta_group_data) == True:
-                    group_ids = okta_group_data[0]['id']
-                    USER_ORGTEAM_GROUP_IDS.append(group_ids)
-            except Exception as exc:
-                exceptions = f'{url} generated an exception: {exc}'
-
-def find_associated_apps_names(group_id):
-    try:
-        page = 1
-        per_page = 100
-        while True:
-            response = okta_get_request(f"https://redcanary.okta.com/api/v1/groups/{group_id}/apps?page={page}&per_page={per_page}")
-            associated_apps_data = response
-            if bool(associated_apps_data) == True:
-                for app_data in associated_apps_data:
-                    USER_ORGTEAM_ASSOCIATED_APPS.append(app_data['name'])
-            if len(associated_apps_data) < per_page:
-                break
-            else:
-                page += 1
-    except OktaApiRateLimitError:
-        # Handle rate limit error
-        exceeded_error_log = f"Rate limit exceeded for group {group_id}"
-        print(exceeded_error_log)
-
-def print_user_roles():
-    set_user_role_groups = set(USER_ROLE_GROUPS)
-    for group in set_user_role_groups:
+# These print the de-duplicated names across all of the users that get_data_from_okta collected.
+def print_user_roles(index):
+    for group in index.names()['role']:
         print(f'{group}\r')
 
-def print_user_orgteams():
-    set_user_orgteam_groups = set(USER_ORGTEAM_GROUPS)
-    for group in set_user_orgteam_groups:
+def print_user_orgteams(index):
+    for group in index.names()['orgteam']:
         print((f'{group}\r'))
 
-def print_user_orgteam_associated_apps():
-    set_user_orgteam_associated_apps = set(USER_ORGTEAM_ASSOCIATED_APPS)
-    for app in set_user_orgteam_associated_apps:
+def print_user_orgteam_associated_apps(index):
+    for app in index.names()['app']:
         print(f'{app}\r')
 
-# Define a function that makes all the API calls
-def get_data_from_okta():
-    find_okta_user_ids()
-    find_user_role_groups()
-    find_group_ids()
-    set_list = set(USER_ORGTEAM_GROUP_IDS)
-    for id in set_list:
-        find_associated_apps_names(id)
+# And these print who has what.
+def print_per_user_report(index):
+    for line in user_report_lines(index):
+        print(line)
+
+def print_group_role_matrix(index):
+    for line in role_matrix_lines(index):
+        print(line)
+
+# Define a function that makes all the API calls. Each user in the input file flows through their own chain
+# of lookups, with at most `concurrency` API calls in flight, and their records are yielded as they are found.
+# Given a synced snapshot, every user in the org is read from it instead, without calling Okta.
+def get_data_from_okta(client, input_file='names.csv', concurrency=MAX_WORKERS, errors=None, snapshot=None, user_resolution='auto', org_size=None):
+    if snapshot is not None:
+        yield from snapshot.records(domain)
+        return
+    pipeline = OktaPipeline(client, domain, concurrency=concurrency, user_resolution=user_resolution, org_size=org_size)
+    yield from pipeline.stream(read_logins(input_file, domain))
+    if errors is not None:
+        errors.extend(pipeline.errors)
+
+# Writes the role, orgteam and app reports to out in one pass over the records.
+def write_reports(records, output_format, out):
+    writer = csv.writer(out)
+    if output_format == 'columnar':
+        names = collect_names(records)
+        writer.writerow(['role', 'orgteam', 'app'])
+        writer.writerows(zip_longest(names['role'], names['orgteam'], names['app'], fillvalue=''))
+        return
+    if output_format == 'csv':
+        writer.writerow(['report', 'name'])
+    for kind, name in unique_names(records):
+        if output_format == 'jsonl':
+            out.write(json.dumps({'report': kind, 'name': name}) + '\n')
+        else:
+            writer.writerow([kind, name])
+
+def write_batch_reports(client, args, snapshot=None):
+    errors = []
+    records = get_data_from_okta(client, args.input, args.concurrency, errors, snapshot, args.user_resolution, args.org_size)
+    if args.output == '-':
+        write_reports(records, args.format, sys.stdout)
+    else:
+        with open(args.output, 'w', newline='') as out:
+            write_reports(records, args.format, out)
+    for error in errors:
+        print(error, file=sys.stderr)
 
 # A UI to handle presenting information to people using the tool.
-def main_menu():
+def main_menu(client, input_file='names.csv', concurrency=MAX_WORKERS, snapshot=None, user_resolution='auto', org_size=None):
     print("")
     print("Welcome to the Okta Reporting Suite! Please give me some time to gather all of the user data from Okta.")
     print("")
-    get_data_from_okta()
+    errors = []
+    index = AccessIndex.from_records(get_data_from_okta(client, input_file, concurrency, errors, snapshot, user_resolution, org_size))
+    for error in errors:
+        print(error, file=sys.stderr)
 
     while True:
         print("")
@@ -210,7 +108,9 @@ def main_menu():
         print("1. Print the Okta role groups of the users you have provided.")
         print("2. Print the Okta orgteam groups of the users you have provided.")
         print("3. Print all apps associated with the org- and team- Okta groups from the org team groups of the users you have provided.")
-        print("4. Exit")
+        print("4. Print each user's role groups, orgteam groups and associated apps.")
+        print("5. Print a matrix of how many members of each orgteam group hold each role.")
+        print("6. Exit")
         print("")
 
         choice = input("> ")
@@ -218,21 +118,33 @@ def main_menu():
             print("")
             print("Here is a de-duped list of okta role groups for the users you have provided.")
             print("")
-            print_user_roles()
+            print_user_roles(index)
             print("")
         elif choice == "2":
             print("")
             print("Here is a de-duped list of okta org team groups for the users you have provided.")
             print("")
-            print_user_orgteams()
+            print_user_orgteams(index)
             print("")
         elif choice == "3":
             print("")
             print("Here is a de-duped list of apps associated with your user's org team groups.")
             print("")
-            print_user_orgteam_associated_apps()
+            print_user_orgteam_associated_apps(index)
             print("")
         elif choice == "4":
+            print("")
+            print("Here is what each of the users you have provided has access to.")
+            print("")
+            print_per_user_report(index)
+            print("")
+        elif choice == "5":
+            print("")
+            print("Here is a CSV of your users' orgteam groups against the roles their members hold.")
+            print("")
+            print_group_role_matrix(index)
+            print("")
+        elif choice == "6":
             print("")
             print("Goodbye!")
             print("")
@@ -241,4 +153,49 @@ def main_menu():
             print("Invalid input. Please select a valid option.")
             input("Press Enter to continue...")
 
-main_menu()
\ No newline at end of file
+def main():
+    parser = argparse.ArgumentParser(description = "Welcome to the Okta Reporting Suite!")
+    parser.add_argument("--input", default = "names.csv", help = "The CSV of names or e-mails to report on. Defaults to names.csv.")
+    parser.add_argument("--format", choices = REPORT_FORMATS, help = "Skip the menu and write all three reports in this format. cmd: python3 okta_reporting_suite.py --format jsonl --output report.jsonl")
+    parser.add_argument("--output", default = "-", help = "Where --format writes the reports. Defaults to stdout.")
+    parser.add_argument("--concurrency", type = int, default = MAX_WORKERS, help = "The most Okta API calls to have in flight at once.")
+    parser.add_argument("--refresh", action = "store_true", help = "Ignore the local Okta cache and fetch everything from Okta again.")
+    parser.add_argument("--offline", action = "store_true", help = "Only use data already in the local Okta cache, without calling Okta.")
+    parser.add_argument("--org-size", type = int, help = "Roughly how many users the org has. Without it, the count from the last run that listed every user is used.")
+    parser.add_argument("--user-resolution", choices = USER_RESOLUTIONS, default = "auto", help = "query looks each name up on its own, scan lists every user once, and auto picks whichever takes fewer requests for the org size.")
+    parser.add_argument("--sync", action = "store_true", help = "Report on the whole org from a local snapshot, fetching only what changed since the last --sync. With --refresh the snapshot is rebuilt, and with --offline it is used as it is.")
+    parser.add_argument("--stats", action = "store_true", help = "When done, print how long each Okta endpoint and pipeline stage took, to stderr.")
+    parser.add_argument("--stats-file", help = "When done, write the same stats to this file, as JSON if it ends in .json and OpenMetrics text otherwise.")
+    args = parser.parse_args()
+
+    # One pooled, keep-alive session shared by every worker thread. Okta responses are cached on disk, so
+    # running the reporting suite and the admin suite over the same names.csv only fetches everything once.
+    client = OktaClient(api_key, domain=domain, max_workers=args.concurrency)
+    if args.stats or args.stats_file:
+        client.stats = OktaStats()
+
+    snapshot = None
+    if args.sync:
+        # The sync asks Okta what changed, so it goes around the response cache.
+        snapshot = OktaSnapshot()
+    else:
+        client.cache = OktaCache(refresh = args.refresh, offline = args.offline)
+
+    try:
+        if snapshot is not None and not args.offline:
+            result = OktaSync(client, snapshot).sync(full = args.refresh)
+            print(', '.join(f'{key}: {value}' for key, value in result.items()), file=sys.stderr)
+        if args.format:
+            write_batch_reports(client, args, snapshot)
+        else:
+            main_menu(client, args.input, args.concurrency, snapshot, args.user_resolution, args.org_size)
+    except OktaApiError as error:
+        sys.exit(str(error))
+    finally:
+        if args.stats:
+            print("\n".join(client.stats.summary_lines()), file=sys.stderr)
+        if args.stats_file:
+            client.stats.write(args.stats_file)
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
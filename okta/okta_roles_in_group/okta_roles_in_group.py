@@ -1,60 +1,67 @@
-import json
 import os
 import sys
+import argparse
+from collections import Counter
 import sensitive as senstitive
-from pip._vendor import requests
 
+# The shared Okta client lives in the okta_client folder next to this one.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "okta_client"))
+from okta_client import OktaClient, OktaApiError, DEFAULT_MAX_WORKERS
 
-api_creds = {
-    "Accept": "application/json",
-    "Contect-Type": "application/json",
-    "Authorization": "SSWS " + senstitive.api_key,
-}
+# Summary: A role census of a group. Every page of the group's members is read, and each member's
+# groups are fetched in parallel on the client's workers under the shared rate limit. Prints how many
+# members hold each role- group, the roles in the isMemberOfGroupNameContains form our Terraform
+# uses, and with --members the roles of each member.
 
-group = sys.argv[1]
+ROLE_PREFIX = "role-"
 
-# Fetches the group ID
-getgroup = requests.get(
-    "https://redcanary.okta.com/api/v1/groups?q=" + group, headers=api_creds
-)
+# Returns {member: [role names]} for every member of a group, members with no role included.
+def role_census(client, group_id):
+    members = {f"/api/v1/users/{user.id}/groups": user for user in client.list_group_users(group_id)}
+    census = {user: [] for user in members.values()}
+    for path, group in client.paginate_many(members):
+        name = group["profile"]["name"]
+        if name.startswith(ROLE_PREFIX):
+            census[members[path]].append(name)
+    return census
 
-group_data = getgroup.json()
+def print_census(group, census, members=False):
+    counts = Counter(role for roles in census.values() for role in set(roles))
+    no_role = sum(1 for roles in census.values() if not roles)
 
-groupid = group_data[0]["id"]
+    print(f"{len(census)} members of {group.name}\n")
+    for role, count in counts.most_common():
+        print(f"{count:>6}  {role}")
+    if no_role:
+        print(f"{no_role:>6}  (no role- group)")
 
-# Fetches the group members
-g_respone = requests.get(
-    "https://redcanary.okta.com/api/v1/groups/" + groupid + "/users", headers=api_creds
-)
+    print("")
+    for role, _ in counts.most_common():
+        print('"isMemberOfGroupNameContains(\\"' + role + '\\") OR ",')
 
-group_data = g_respone.json()
+    if members:
+        print("")
+        for user, roles in sorted(census.items(), key=lambda item: item[0].login):
+            print(f"{user.login}: {', '.join(sorted(roles)) or '(no role- group)'}")
 
-# Creates a list of group members
-group_members = [g["id"] for g in group_data]
+def main():
+    parser = argparse.ArgumentParser(description = "Counts the role- groups held by the members of a group.")
+    parser.add_argument("group", help = "The exact name of the group. cmd: python3 okta_roles_in_group.py org-engineering")
+    parser.add_argument("--members", action = "store_true", help = "Also list the role- groups of each member.")
+    parser.add_argument("--concurrency", type = int, default = DEFAULT_MAX_WORKERS, help = "The most Okta API calls in flight at once.")
+    args = parser.parse_args()
 
-grouplist = []
+    client = OktaClient(senstitive.api_key, domain=senstitive.domain, max_workers=args.concurrency)
 
-# Fetches the role of each group member
-for user in group_members:
-    getid = requests.get(
-        "https://redcanary.okta.com/api/v1/users/" + user + "/groups", headers=api_creds
-    )
-    data = getid.json()
-    role = [
-        g["profile"]["name"] for g in data if g["profile"]["name"].startswith("role-")
-    ]
-    output = json.dumps(role, indent=1)
-    strip_1 = output.replace('"', "")
-    strip_2 = strip_1.replace("]", "")
-    strip_3 = strip_2.replace("[", "")
-    output_role = strip_3.replace(",", "")
-    grouplist.append(output_role)
+    try:
+        # An exact match, so org-engineering can't turn out to be org-engineering-managers.
+        group = client.find_group(args.group)
+        if group is None:
+            sys.exit(f"There is no Okta group named {args.group}")
 
-# Removes carriage returns from the list
-newgrouplist = [item.strip() for item in grouplist]
+        print_census(group, role_census(client, group.id), members=args.members)
+    except OktaApiError as error:
+        sys.exit(str(error))
 
-# Prints duplicates from the list
-newgrouplist = list(dict.fromkeys(newgrouplist))
-
-for item in newgrouplist:
-    print('"isMemberOfGroupNameContains(\\"' + item + '\\") OR ",')
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -1 +1,2 @@
-api_key = "" # okta read-only API token 
\ No newline at end of file
+api_key = "" # okta read-only API token 
+domain = "" # okta domain, e.g. "redcanary" for redcanary.okta.com
\ No newline at end of file
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The tests import the scripts the same way the scripts import each other, from their own folders.
+OKTA_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+for folder in ('okta_client', 'okta_admin_suite', 'okta_benchmark'):
+    sys.path.insert(0, os.path.join(OKTA_FOLDER, folder))
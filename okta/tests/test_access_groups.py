@@ -0,0 +1,144 @@
+from access_groups import AccessGroup, parse_access_groups, edit_access_groups
+
+
+def block(*names, indent='    ', comma=',', newline='\n'):
+    lines = [f'{indent}"isMemberOfGroupNameContains(\\"{name}\\") OR ",{newline}' for name in names]
+    lines[-1] = f'{indent}"isMemberOfGroupNameContains(\\"{names[-1]}\\")"{comma}{newline}'
+    return lines
+
+
+def tf_file(*names, newline='\n'):
+    return [f'locals {{{newline}', f'  rule = [{newline}', *block(*names, newline=newline), f'  ]{newline}', f'}}{newline}']
+
+
+def names_in(lines):
+    return [group.names for group in parse_access_groups(lines)]
+
+
+def test_parse_and_render_round_trip():
+    lines = tf_file('team-a', 'role-b', 'org-c')
+    groups = parse_access_groups(lines)
+    assert [(group.start, group.end, group.names) for group in groups] == [(2, 5, ['team-a', 'role-b', 'org-c'])]
+    assert groups[0].render() == lines[2:5]
+
+
+def test_single_line_group_without_comma_round_trips():
+    lines = ['    "isMemberOfGroupNameContains(\\"role-a\\")"\n']
+    group, = parse_access_groups(lines)
+    assert group.comma == ''
+    assert group.render() == lines
+
+
+def test_separate_blocks_parse_separately():
+    lines = block('team-a', 'role-b') + ['  ],\n', '  other = [\n'] + block('role-c')
+    assert names_in(lines) == [['team-a', 'role-b'], ['role-c']]
+
+
+def test_nothing_to_change_returns_none():
+    lines = tf_file('team-a', 'role-b')
+    assert edit_access_groups(lines, {'team-z': ['role-y']}, ['role-x']) is None
+    assert edit_access_groups(tf_file('role-b', 'team-a'), {}, normalize=True) is None
+
+
+def test_add_goes_above_the_name_that_called_for_it():
+    lines = tf_file('team-a', 'role-b')
+    new_lines = edit_access_groups(lines, {'role-b': ['role-new']})
+    assert new_lines == tf_file('team-a', 'role-new', 'role-b')
+
+
+def test_add_to_the_last_line_keeps_the_closing_line_last():
+    new_lines = edit_access_groups(tf_file('team-a'), {'team-a': ['role-new']})
+    assert new_lines == tf_file('role-new', 'team-a')
+
+
+def test_add_skips_names_already_in_the_group():
+    assert edit_access_groups(tf_file('role-new', 'team-a'), {'team-a': ['role-new']}) is None
+
+
+def test_remove_from_the_middle():
+    assert edit_access_groups(tf_file('team-a', 'role-b', 'org-c'), {}, ['role-b']) == tf_file('team-a', 'org-c')
+
+
+def test_remove_the_last_line_moves_the_closing_line_up():
+    new_lines = edit_access_groups(tf_file('team-a', 'role-b'), {}, ['role-b'])
+    assert new_lines == tf_file('team-a')
+    assert new_lines[2] == '    "isMemberOfGroupNameContains(\\"team-a\\")",\n'
+
+
+def test_remove_every_name_drops_the_block():
+    lines = tf_file('role-b')
+    assert edit_access_groups(lines, {}, ['role-b']) == lines[:2] + lines[3:]
+
+
+def test_normalize_sorts_and_dedupes():
+    new_lines = edit_access_groups(tf_file('team-a', 'misc', 'role-b', 'org-c', 'role-b'), {}, normalize=True)
+    assert new_lines == tf_file('role-b', 'org-c', 'team-a', 'misc')
+
+
+def test_additions_removals_and_normalize_in_one_pass():
+    lines = tf_file('team-a', 'role-old') + tf_file('org-c', 'role-old')
+    new_lines = edit_access_groups(lines, {'team-a': ['role-new'], 'org-c': ['role-new']}, ['role-old'], normalize=True)
+    assert names_in(new_lines) == [['role-new', 'team-a'], ['role-new', 'org-c']]
+
+
+def test_only_changed_blocks_are_rendered_again():
+    untouched = ['    "isMemberOfGroupNameContains(\\"team-x\\")"   ,\n']
+    lines = untouched + ['  ],\n'] + block('team-a', 'role-b')
+    assert edit_access_groups(lines, {}, ['role-b'])[:2] == untouched + ['  ],\n']
+
+
+def test_commented_out_line_spoils_the_block():
+    lines = ['    "isMemberOfGroupNameContains(\\"team-a\\") OR ",\n',
+             '    # "isMemberOfGroupNameContains(\\"role-old\\") OR ",\n',
+             '    "isMemberOfGroupNameContains(\\"role-b\\")",\n']
+    assert names_in(lines) == []
+    assert edit_access_groups(lines, {'role-b': ['role-new']}, ['team-a'], normalize=True) is None
+
+
+def test_plain_comment_inside_a_block_spoils_the_rest_of_it():
+    lines = ['    "isMemberOfGroupNameContains(\\"team-a\\") OR ",\n',
+             '    # why team-a is here\n',
+             '    "isMemberOfGroupNameContains(\\"role-b\\")",\n',
+             '  ]\n'] + block('role-b')
+    # The block after the ] is a fresh one and still gets edited.
+    assert names_in(lines) == [['role-b']]
+    assert edit_access_groups(lines, {}, ['role-b']) == lines[:4]
+
+
+def test_trailing_comment_spoils_the_block():
+    lines = ['    "isMemberOfGroupNameContains(\\"team-a\\") OR ", # owners\n',
+             '    "isMemberOfGroupNameContains(\\"role-old\\")",\n']
+    assert names_in(lines) == []
+    # Left for the rewriter to report, rather than edited with the comment in the way.
+    assert edit_access_groups(lines, {}, ['role-old']) is None
+
+
+def test_or_carried_past_the_end_of_a_run_spoils_it():
+    lines = ['    "isMemberOfGroupNameContains(\\"team-a\\") OR ",\n',
+             '    "isMemberOfGroupNameContains(\\"role-b\\") OR " + local.extra,\n',
+             '    "isMemberOfGroupNameContains(\\"org-c\\")",\n']
+    assert names_in(lines) == []
+
+
+def test_crlf_files_keep_their_line_endings():
+    lines = tf_file('team-a', 'role-b', newline='\r\n')
+    assert names_in(lines) == [['team-a', 'role-b']]
+    new_lines = edit_access_groups(lines, {'role-b': ['role-new']}, ['team-a'])
+    assert new_lines == tf_file('role-new', 'role-b', newline='\r\n')
+    assert all(line.endswith('\r\n') for line in new_lines)
+
+
+def test_last_line_of_a_file_without_a_newline():
+    lines = block('team-a', 'role-b', comma='')
+    lines[-1] = lines[-1].rstrip('\n')
+    new_lines = edit_access_groups(lines, {}, ['role-b'])
+    assert new_lines == ['    "isMemberOfGroupNameContains(\\"team-a\\")"']
+
+
+def test_access_group_tracks_changes():
+    group = AccessGroup(0, 1, '', ',', '\n', ['team-a'])
+    group.remove('role-x')
+    group.add('team-a')
+    assert not group.changed
+    group.add('role-b', before='team-a')
+    assert group.changed and group.names == ['role-b', 'team-a']
@@ -0,0 +1,23 @@
+import time
+from okta_cache import OktaCache
+
+
+def entry(body, age):
+    return {'body': body, 'next_url': None, 'etag': None, 'fetched_at': time.time() - age}
+
+
+def test_user_lookups_expire_sooner_than_user_details():
+    cache = OktaCache(':memory:')
+    lookup = 'https://example.okta.com/api/v1/users?filter=profile.login+eq+%22a.b%40example.com%22'
+    assert cache.ttl(lookup) < cache.ttl('https://example.okta.com/api/v1/users/00u1')
+    assert cache.is_fresh(lookup, entry([{'id': '00u1'}], 60))
+    assert not cache.is_fresh(lookup, entry([{'id': '00u1'}], 60 * 60))
+
+
+def test_empty_listings_are_never_fresh():
+    cache = OktaCache(':memory:')
+    lookup = 'https://example.okta.com/api/v1/users?filter=profile.login+eq+%22new.hire%40example.com%22'
+    assert not cache.is_fresh(lookup, entry([], 0))
+    # A 404 is cached like any other answer.
+    assert cache.is_fresh('https://example.okta.com/api/v1/groups/00g1/apps', entry(None, 0))
+
@@ -0,0 +1,64 @@
+import time
+import threading
+import pytest
+from okta_client import OktaClient, RateLimitGovernor, User, USER_PAGE_SIZE
+from okta_pipeline import OktaPipeline
+from mock_okta_server import MockOktaServer, MockOrg
+
+
+@pytest.fixture
+def mock_okta():
+    # Every request is held a little, so a scan of the org takes long enough to be seen running.
+    server = MockOktaServer(0, MockOrg(users=40 * USER_PAGE_SIZE), latency=0.02)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client(mock_okta):
+    client = OktaClient('test', base_url=mock_okta.base_url, max_workers=4, governor=RateLimitGovernor())
+    yield client
+    client.close()
+
+
+def logins(users):
+    return [f'first{user}.last{user}' for user in users]
+
+
+def test_users_on_the_first_page_resolve_before_the_scan_ends(client):
+    # More logins than the pipeline keeps in flight, so most of them start after their page arrived.
+    wanted = logins(range(USER_PAGE_SIZE))
+    pipeline = OktaPipeline(client, 'example', concurrency=4, user_resolution='scan')
+    users = []
+    for record in pipeline.stream(wanted):
+        if isinstance(record, User):
+            assert not pipeline._user_scan.done(), f'{record.login} waited for the whole scan'
+            users.append(record.login)
+    assert sorted(users) == sorted(wanted)
+    assert pipeline.errors == []
+
+
+def test_scan_and_query_find_the_same_users(client):
+    wanted = logins([0, 5, 7999]) + ['nobody.here', 'FIRST7.LAST7']
+    found = {}
+    for resolution in ('scan', 'query'):
+        pipeline = OktaPipeline(client, 'example', concurrency=4, user_resolution=resolution)
+        found[resolution] = sorted(record.login for record in pipeline.stream(wanted) if isinstance(record, User))
+        assert pipeline.errors == []
+    assert found['scan'] == found['query'] == sorted(logins([0, 5, 7999]) + ['FIRST7.LAST7'])
+
+
+def test_stopping_early_cancels_the_users_in_flight(client, mock_okta):
+    pipeline = OktaPipeline(client, 'example', concurrency=4, user_resolution='query')
+    stream = pipeline.stream(logins(range(2000)))
+    next(stream)
+    stream.close()
+    # Give the requests already on the wire when the consumer stopped time to land, then no more come.
+    time.sleep(0.2)
+    settled = mock_okta.stats.requests
+    time.sleep(0.5)
+    assert mock_okta.stats.requests == settled
+    assert pipeline._loop.is_closed()
@@ -0,0 +1,38 @@
+import threading
+import pytest
+from okta_client import OktaClient, RateLimitGovernor
+from okta_stats import OktaStats
+from mock_okta_server import MockOktaServer, MockOrg
+
+
+@pytest.fixture
+def client():
+    server = MockOktaServer(0, MockOrg(users=50))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = OktaClient('test', base_url=server.base_url, max_workers=4, governor=RateLimitGovernor(), stats=OktaStats())
+    yield client
+    client.close()
+    server.shutdown()
+    server.server_close()
+
+
+def test_requests_are_counted_per_endpoint(client):
+    assert len(list(client.list_users())) == 50
+    client.get_json('/api/v1/users/00u1/groups')
+    endpoints = client.stats.as_json()['endpoints']
+    assert endpoints['/api/v1/users']['requests'] == 1
+    assert endpoints['/api/v1/users/{id}/groups']['statuses'] == {'200': 1}
+    assert endpoints['/api/v1/users']['body_bytes'] > 0
+
+
+def test_a_404_is_an_answer_not_a_failure(client):
+    assert client.get_json('/api/v1/groups/00gdeleted/apps') is None
+    data = client.stats.as_json()
+    assert data['endpoints']['/api/v1/groups/{id}/apps']['statuses'] == {'404': 1}
+    assert data['failed_urls'] == []
+
+
+def test_unthrottled_run_reports_no_rate_limit_waits(client):
+    list(client.paginate_many([f'/api/v1/users/00u{user}/groups' for user in range(50)]))
+    assert client.stats.as_json()['rate_limit_waits'] == {}
+    assert not any(line.startswith('Waited') for line in client.stats.summary_lines())
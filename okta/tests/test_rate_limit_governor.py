@@ -0,0 +1,90 @@
+import time
+import threading
+import pytest
+import okta_client
+from okta_client import RateLimitGovernor
+
+
+class Response:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+def rate_limit_headers(limit, remaining, reset_in=60):
+    return {'X-Rate-Limit-Limit': str(limit), 'X-Rate-Limit-Remaining': str(remaining),
+            'X-Rate-Limit-Reset': str(int(time.time()) + reset_in)}
+
+
+@pytest.fixture
+def short_window(monkeypatch):
+    monkeypatch.setattr(okta_client, 'RATE_LIMIT_WINDOW', 0.2)
+
+
+def test_unknown_bucket_does_not_wait():
+    assert RateLimitGovernor().acquire('/api/v1/users') == 0.0
+
+
+def test_headerless_429_waits_for_the_window_and_then_lets_requests_through(short_window, capsys):
+    governor = RateLimitGovernor()
+    governor.update('/api/v1/users', Response(429))
+    waited = governor.acquire('/api/v1/users')
+    assert 0.1 < waited < 2
+    # And the next window still has a request to spare rather than pushing the reset out forever.
+    governor.acquire('/api/v1/users')
+
+
+def test_headerless_429_keeps_the_known_limit():
+    governor = RateLimitGovernor()
+    governor.update('/api/v1/users', Response(200, rate_limit_headers(600, 600)))
+    governor.update('/api/v1/users', Response(429))
+    assert governor._buckets['/api/v1/users']['limit'] == 600
+    assert governor._buckets['/api/v1/users']['remaining'] == 0
+
+
+def test_out_of_order_responses_keep_the_lowest_remaining():
+    governor = RateLimitGovernor()
+    governor.update('/api/v1/groups', Response(200, rate_limit_headers(100, 40)))
+    governor.update('/api/v1/groups', Response(200, rate_limit_headers(100, 70)))
+    assert governor._buckets['/api/v1/groups']['remaining'] == 40
+
+
+def test_pacing_starts_once_half_the_window_is_spent():
+    governor = RateLimitGovernor(headroom=0)
+    governor.update('/api/v1/apps', Response(200, rate_limit_headers(100, 60)))
+    governor.acquire('/api/v1/apps')
+    assert governor._buckets['/api/v1/apps']['next_at'] == 0
+    governor.update('/api/v1/apps', Response(200, rate_limit_headers(100, 40)))
+    governor.acquire('/api/v1/apps')
+    assert governor._buckets['/api/v1/apps']['next_at'] > time.monotonic()
+
+
+def test_waiting_workers_share_one_message_per_window(short_window, capsys):
+    governor = RateLimitGovernor()
+    governor.update('/api/v1/users', Response(200, rate_limit_headers(50, 50)))
+    governor.update('/api/v1/users', Response(429))
+    workers = [threading.Thread(target=governor.acquire, args=('/api/v1/users',)) for _ in range(8)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(timeout=5)
+    assert not any(worker.is_alive() for worker in workers)
+    assert capsys.readouterr().out.count('nearly used up') == 1
+
+
+
+def test_lock_contention_is_not_a_rate_limit_wait():
+    governor = RateLimitGovernor()
+    governor.update('/api/v1/users', Response(200, rate_limit_headers(600, 590)))
+    holding = threading.Event()
+
+    def hold_lock():
+        with governor._condition:
+            holding.set()
+            time.sleep(0.1)
+
+    holder = threading.Thread(target=hold_lock)
+    holder.start()
+    holding.wait()
+    assert governor.acquire('/api/v1/users') == 0.0
+    holder.join()
@@ -0,0 +1,58 @@
+import shutil
+import subprocess
+import pytest
+from terraform_rewriter import rewrite_access_groups, RewriteIncompleteError
+
+
+def access_group(*names, newline='\n'):
+    lines = [f'    "isMemberOfGroupNameContains(\\"{name}\\") OR ",{newline}' for name in names]
+    lines[-1] = f'    "isMemberOfGroupNameContains(\\"{names[-1]}\\")",{newline}'
+    return ''.join(lines)
+
+
+@pytest.fixture
+def repo(tmp_path):
+    (tmp_path / 'mod').mkdir()
+    (tmp_path / 'mod' / 'a.tf').write_text('rule = [\n' + access_group('team-a', 'role-old') + ']')
+    (tmp_path / 'mod' / 'b.tf').write_bytes(('rule = [\r\n' + access_group('role-old', 'org-b', newline='\r\n') + ']\r\n').encode())
+    (tmp_path / 'c.tf').write_text('rule = [\n' + access_group('team-c') + ']\n')
+    return tmp_path
+
+
+def test_dry_run_writes_nothing_and_prints_a_diff_per_changed_file(repo, capsys):
+    before = {path: path.read_bytes() for path in repo.rglob('*.tf')}
+    changed = rewrite_access_groups(str(repo), removals=['role-old'], dry_run=True)
+    assert sorted(changed) == [str(repo / 'mod' / 'a.tf'), str(repo / 'mod' / 'b.tf')]
+    assert {path: path.read_bytes() for path in repo.rglob('*.tf')} == before
+    diff = capsys.readouterr().out
+    assert '--- a/mod/a.tf\n+++ b/mod/a.tf\n' in diff
+    assert ']\n\\ No newline at end of file\n--- a/mod/b.tf' in diff
+
+
+@pytest.mark.skipif(shutil.which('git') is None, reason='needs git')
+def test_dry_run_diff_applies_with_git_apply(repo, capsys):
+    rewrite_access_groups(str(repo), removals=['role-old'], dry_run=True)
+    (repo / 'changes.diff').write_text(capsys.readouterr().out, newline='')
+    subprocess.run(['git', 'init', '-q'], cwd=repo, check=True)
+    subprocess.run(['git', 'apply', 'changes.diff'], cwd=repo, check=True)
+    assert (repo / 'mod' / 'a.tf').read_text() == 'rule = [\n' + access_group('team-a') + ']'
+
+
+def test_rewrite_keeps_line_endings(repo):
+    rewrite_access_groups(str(repo), removals=['role-old'])
+    assert (repo / 'mod' / 'b.tf').read_bytes() == ('rule = [\r\n' + access_group('org-b', newline='\r\n') + ']\r\n').encode()
+    assert (repo / 'mod' / 'a.tf').read_text() == 'rule = [\n' + access_group('team-a') + ']'
+    assert (repo / 'c.tf').read_text() == 'rule = [\n' + access_group('team-c') + ']\n'
+
+
+def test_removal_left_in_an_unparsed_block_is_reported(repo, capsys):
+    commented = repo / 'd.tf'
+    commented.write_text('rule = [\n    "isMemberOfGroupNameContains(\\"team-a\\") OR ", # owners\n'
+                         '    "isMemberOfGroupNameContains(\\"role-old\\")",\n]\n')
+    for dry_run in (True, False):
+        with pytest.raises(RewriteIncompleteError) as error:
+            rewrite_access_groups(str(repo), removals=['role-old'], dry_run=dry_run)
+        assert error.value.left_behind == [(str(commented), 3, '    "isMemberOfGroupNameContains(\\"role-old\\")",\n')]
+        assert f'{commented}:3:' in str(error.value)
+    # Every file that could be edited still was.
+    assert 'role-old' not in (repo / 'mod' / 'a.tf').read_text()
@@ -1,73 +1,73 @@
-import sensitive as sensitive
-from webbrowser import get
+import os
+import sys
+import csv
 import json
-from pip._vendor import requests
-
-oktaFile=('sensitive.py')
-
-api_creds = {
-"Accept" : "application/json",
-"Contect-Type" : "application/json",
-"Authorization" : "SSWS " + sensitive.api_key
-}
-
-class my_dictionary(dict):
-    def __init__(self):
-        self = dict()
-    def add(self, key, value):
-        self[key] = value
-
-dict_obj = my_dictionary()
-# Get list of all application IDs and Labels and add to dict_obj
-respone = requests.get("https://redcanary.okta.com/api/v1/apps?limit=200",
-                        headers = api_creds)
-
-data = respone.json()
-
-def myFunc(e):
-    return e['id']
-def myFunc2(e):
-    return e['label']
-def myFunc3(e):
-    return e['status']
-data.sort(key=myFunc)
-data.sort(key=myFunc2)
-data.sort(key=myFunc3)
-apps=[]
-for app in data:
-    if app['status'] == 'ACTIVE': 
-        dict_obj.add(app['label'], app['id'])
-# Get list of users for all application IDs in dict_obj
-for key, value in dict_obj.items():
-    resptwo = requests.get("https://redcanary.okta.com/api/v1/apps/" + value + "/users?limit=500",
-                        headers = api_creds)
-    datatwo = resptwo.json()
-    def myFunc(e):
-        return e['credentials']['userName']
-
-    # Filter for null values
-    filtered_data = [user for user in datatwo if user['scope'] == 'USER' and user['credentials'] is not None]
-
-    filtered_data.sort(key=myFunc)
-
-    usrs = []
-    for user in filtered_data:
-        usrs.append(user['credentials']['userName'])
-
-    output = json.dumps(usrs, indent=1)
-    output_fmt = output.replace('"', '').replace("]", "").replace("[", "").replace(",", "")
-
-    if output_fmt == "":
-        continue
-    else:
-        print("Okta users assigned directly to " + key + ": ")
-        print("")
-        print(output_fmt)
-                  
-
-
-    
-
-
-
+import argparse
+import sensitive as sensitive
 
+# The shared Okta client lives in the okta_client folder next to this one.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'okta_client'))
+from okta_client import OktaClient, OktaApiError, AppUser, DEFAULT_MAX_WORKERS, APP_USER_PAGE_SIZE
+
+# Summary: Audits every active app for Okta users that are assigned to it directly rather than
+# through a group. Every page of apps is read, and the users of every app are paged in parallel on
+# the client's workers under the shared rate limit. Findings are written as soon as their page
+# arrives with --format jsonl or csv, or grouped by app for reading on screen.
+
+OUTPUT_FORMATS = ('text', 'jsonl', 'csv')
+
+# The fields of each finding, in the order the csv format writes them.
+FINDING_FIELDS = ('app_id', 'app_label', 'user_id', 'user_name')
+
+# Yields (app, app user) for every user assigned directly to an active app, as each page of app users
+# arrives. Users without a username are direct assignments too, so they are kept.
+def direct_assignments(client):
+    apps = {f'/api/v1/apps/{app.id}/users': app for app in client.list_apps(filter='status eq "ACTIVE"')}
+    for path, app_user in client.paginate_many(apps, {'limit': APP_USER_PAGE_SIZE}):
+        if app_user['scope'] == 'USER':
+            app = apps[path]
+            yield app, AppUser.from_okta(app.id, app_user)
+
+def write_findings(findings, output_format, out):
+    if output_format == 'text':
+        # Grouping by app means waiting for the whole audit before printing anything.
+        users_by_app = {}
+        for app, user in findings:
+            users_by_app.setdefault(app, []).append(user.user_name or user.user_id)
+        for app in sorted(users_by_app, key=lambda app: app.label):
+            out.write("Okta users assigned directly to " + app.label + ": \n\n")
+            for usr in sorted(users_by_app[app]):
+                out.write(" " + usr + "\n")
+            out.write("\n")
+        return
+    writer = csv.writer(out)
+    if output_format == 'csv':
+        writer.writerow(FINDING_FIELDS)
+    for app, user in findings:
+        row = (app.id, app.label, user.user_id, user.user_name)
+        if output_format == 'jsonl':
+            out.write(json.dumps(dict(zip(FINDING_FIELDS, row))) + '\n')
+        else:
+            writer.writerow(row)
+
+def main():
+    parser = argparse.ArgumentParser(description = "Lists the Okta users assigned directly to active apps rather than through a group.")
+    parser.add_argument("--format", choices = OUTPUT_FORMATS, default = "text", help = "jsonl and csv write one row per finding as soon as it is found. cmd: python3 users_added_directly_to_apps.py --format jsonl --output direct.jsonl")
+    parser.add_argument("--output", default = "-", help = "Where to write the findings. Defaults to stdout.")
+    parser.add_argument("--concurrency", type = int, default = DEFAULT_MAX_WORKERS, help = "The most Okta API calls in flight at once.")
+    args = parser.parse_args()
+
+    client = OktaClient(sensitive.api_key, domain=sensitive.domain, max_workers=args.concurrency)
+
+    findings = direct_assignments(client)
+    try:
+        if args.output == '-':
+            write_findings(findings, args.format, sys.stdout)
+        else:
+            with open(args.output, 'w', newline='') as out:
+                write_findings(findings, args.format, out)
+    except OktaApiError as error:
+        sys.exit(str(error))
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,56 @@
+import os
 import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pip._vendor import requests
+from pip._vendor.requests.adapters import HTTPAdapter
 import boto3
 from botocore.exceptions import ClientError
 
+SECRET_NAME = "prod/quip_token"
+REGION_NAME = "us-east-1"
+# Set QUIP_SCIM_URL in the Lambda's environment to point it at another SCIM endpoint, such as the
+# mock server in okta/okta_benchmark.
+SCIM_URL = os.environ.get("QUIP_SCIM_URL", "https://scim.quip.com/2")
 
-def get_secret():
+# The most SCIM calls a batch event has in flight at once when Quip can't take it as one /Bulk request.
+MAX_WORKERS = 8
+
+BULK_REQUEST_SCHEMA = "urn:ietf:params:scim:api:messages:2.0:BulkRequest"
+
+# How long a warm container keeps using the token it fetched before asking Secrets Manager again.
+# A token rotated sooner than that is picked up by the retry on 401 in scim_request.
+TOKEN_TTL = 15 * 60
+
+# Everything at module level lives as long as the Lambda container does, so warm invocations re-use
+# the Secrets Manager client, the token and the open keep-alive connection to Quip instead of setting
+# each of them up again.
+secrets_client = boto3.session.Session().client(
+    service_name='secretsmanager',
+    region_name=REGION_NAME
+)
+
+scim_session = requests.Session()
+scim_session.mount("https://", HTTPAdapter(pool_maxsize=MAX_WORKERS))
+scim_session.headers.update({
+    "Accept" : "application/json",
+    "Content-Type" : "application/json",
+})
+
+cached_token = None
+cached_token_at = 0.0
+token_lock = threading.Lock()
 
-    secret_name = "prod/quip_token"
-    region_name = "us-east-1"
+# The bulk section of Quip's /ServiceProviderConfig, fetched once per container. Empty if Quip doesn't
+# support /Bulk.
+bulk_config = None
 
-    # Create a Secrets Manager client
-    session = boto3.session.Session()
-    client = session.client(
-        service_name='secretsmanager',
-        region_name=region_name
-    )
 
+def get_secret():
     try:
-        get_secret_value_response = client.get_secret_value(
-            SecretId=secret_name
+        get_secret_value_response = secrets_client.get_secret_value(
+            SecretId=SECRET_NAME
         )
     except ClientError as e:
         # For a list of exceptions thrown, see
@@ -26,27 +58,153 @@ def get_secret():
         raise e
 
     return get_secret_value_response['SecretString']
-    
-get_secret()
+
+
+# Returns the Quip token, fetching it from Secrets Manager only when the cached one is missing, older
+# than TOKEN_TTL, or refresh is asked for.
+def get_token(refresh=False):
+    global cached_token, cached_token_at
+    with token_lock:
+        if refresh or cached_token is None or time.time() - cached_token_at > TOKEN_TTL:
+            secret = get_secret()
+            cached_token = json.loads(secret).get("quip_token")
+            cached_token_at = time.time()
+        return cached_token
+
+
+# Makes a SCIM call over the pooled session. A 401 means the cached token has been rotated, so it is
+# fetched again and the call is retried once.
+def scim_request(method, path, **kwargs):
+    response = scim_session.request(method, SCIM_URL + path, headers={"Authorization": "Bearer " + get_token()}, **kwargs)
+    if response.status_code == 401:
+        response = scim_session.request(method, SCIM_URL + path, headers={"Authorization": "Bearer " + get_token(refresh=True)}, **kwargs)
+    return response
+
+
+# If Quip can't be reached to ask, the batch goes user by user, so each user gets their own status,
+# and the next invocation asks again.
+def get_bulk_config():
+    global bulk_config
+    if bulk_config is None:
+        try:
+            response = scim_request("GET", "/ServiceProviderConfig")
+        except requests.RequestException:
+            return {}
+        bulk = response.json().get("bulk", {}) if response.status_code == 200 else {}
+        bulk_config = bulk if bulk.get("supported") else {}
+    return bulk_config
+
+
+# Works out which operation of a chunk a /Bulk result is for. Servers only have to echo the bulkId
+# of a POST, so a result without one is matched by the location it names, or failing that by its
+# place in the response, which follows the order of the request.
+def result_bulk_id(result, chunk, position):
+    if result.get("bulkId"):
+        return result["bulkId"]
+    location = result.get("location") or ""
+    for operation in chunk:
+        if location and location.endswith(operation["path"]):
+            return operation["bulkId"]
+    return chunk[position]["bulkId"] if position < len(chunk) else None
+
+
+# Sends SCIM operations through /Bulk, at most maxOperations per request. Returns {bulkId: (status,
+# error)} for every operation. A chunk that can't be sent fails every operation in it.
+def scim_bulk(operations):
+    max_operations = get_bulk_config().get("maxOperations") or len(operations)
+    results = {}
+    for start in range(0, len(operations), max_operations):
+        chunk = operations[start:start + max_operations]
+        body = {"schemas": [BULK_REQUEST_SCHEMA], "Operations": chunk}
+        try:
+            response = scim_request("POST", "/Bulk", data=json.dumps(body))
+        except requests.RequestException as e:
+            for operation in chunk:
+                results[operation["bulkId"]] = (None, str(e))
+            continue
+        if response.status_code != 200:
+            for operation in chunk:
+                results[operation["bulkId"]] = (response.status_code, response.text)
+            continue
+        for position, result in enumerate(response.json().get("Operations", [])):
+            status = int(result.get("status", 0))
+            error = (result.get("response") or {}).get("detail") if status >= 400 else None
+            results[result_bulk_id(result, chunk, position)] = (status, error)
+    return results
+
+
+# The status a batch event reports for one user.
+def user_status(email, status, error=None):
+    result = {"email": email, "statusCode": status}
+    if error:
+        result["error"] = error
+    return result
+
+
+# Returns the Quip SCIM id of the user with this e-mail, or None if there isn't one.
+def find_user_id(email):
+    response = scim_request("GET", "/Users?filter=" + email)
+    resources = response.json().get('Resources') or []
+    return resources[0]['id'] if resources else None
+
+
+# Returns (id, None) for a user that was found, or (None, their status) for one that can't be deleted.
+def lookup_user(email):
+    try:
+        id_value = find_user_id(email)
+    except requests.RequestException as e:
+        return None, user_status(email, None, str(e))
+    if id_value is None:
+        return None, user_status(email, 404, "No Quip user with this e-mail")
+    return id_value, None
+
+
+def deprovision_user(email):
+    id_value, failure = lookup_user(email)
+    if failure:
+        return failure
+    try:
+        response = scim_request("DELETE", "/Users/" + id_value)
+    except requests.RequestException as e:
+        return user_status(email, None, str(e))
+    return user_status(email, response.status_code, response.text if response.status_code >= 400 else None)
+
+
+# Deletes every user in a batch. Their ids are looked up up to MAX_WORKERS at a time, and then deleted
+# in /Bulk requests if Quip supports them, or deleted as they are found otherwise. Returns the status
+# of each user, in the order they were given.
+def deprovision_users(users):
+    emails = [user.get('email', '') for user in users]
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        if not get_bulk_config():
+            return list(executor.map(deprovision_user, emails))
+        lookups = list(executor.map(lookup_user, emails))
+    operations = [
+        {"method": "DELETE", "path": "/Users/" + id_value, "bulkId": str(i)}
+        for i, (id_value, failure) in enumerate(lookups) if failure is None
+    ]
+    results = scim_bulk(operations) if operations else {}
+    return [
+        failure or user_status(email, *results.get(str(i), (None, "No result from /Bulk")))
+        for i, (email, (id_value, failure)) in enumerate(zip(emails, lookups))
+    ]
+
+
+# A single user comes in as {"email": ...}, and a batch as {"users": [{"email": ...}, ...]}.
 def lambda_handler(event, context):
-    secret = get_secret()
-    token = json.loads(secret)
-    bearer = token.get("quip_token")
-    api_creds = {
-    "Accept" : "application/json",
-    "Content-Type" : "application/json",
-    "Authorization" : "Bearer " + bearer
-    }
-    
-    
+    if 'users' in event:
+        return {
+            'statusCode': 200,
+            'body': deprovision_users(event['users'])
+        }
+
     email = event.get('email', '')
-    response1 = requests.get ("https://scim.quip.com/2/Users?filter=" + email, headers = api_creds)
+    response1 = scim_request("GET", "/Users?filter=" + email)
     data = response1.json()
     id_value = data['Resources'][0]['id']
     
-    response2 = requests.delete ("https://scim.quip.com/2/Users/" + id_value, headers = api_creds)
+    response2 = scim_request("DELETE", "/Users/" + id_value)
     return {
         'statusCode': 200,
         'body': response2
      }
-